@@ -3,18 +3,19 @@ import time
 
 import voyager.utils as U
 from javascript import require
-from langchain_openai import ChatOpenAI
 from langchain.prompts import SystemMessagePromptTemplate
-from langchain.schema import AIMessage, HumanMessage, SystemMessage
-from langchain_ollama import ChatOllama
+from langchain.schema import AIMessage, ChatGeneration, HumanMessage, SystemMessage
 
 
+from voyager.llm import LLMCache, LLMRegistry, TokenCounter
 from voyager.prompts import load_prompt
 from voyager.control_primitives_context import load_control_primitives_context
 from voyager.utils.vision import get_vlm_images, format_api_query
 
 
 class ActionAgent:
+    CODE_PATTERN = re.compile(r"```(?:javascript|js)(.*?)```", re.DOTALL)
+
     def __init__(
         self,
         ollama=False,
@@ -29,6 +30,9 @@ class ActionAgent:
         resume=False,
         chat_log=True,
         execution_error=True,
+        llm_registry=None,
+        prompt_token_budget=None,
+        stream=False,
     ):
         # vision part
         self.use_vision = use_vision
@@ -36,7 +40,9 @@ class ActionAgent:
         self.nb_images_to_use = nb_images_to_use
 
         self.model_name = model_name
-        self.ollama = ollama
+        if llm_registry is None:
+            llm_registry = LLMRegistry.from_options(ollama, ollama_url, request_timout)
+        self.ollama = llm_registry.ollama
         self.ckpt_dir = ckpt_dir
         self.chat_log = chat_log
         self.execution_error = execution_error
@@ -46,19 +52,23 @@ class ActionAgent:
             self.chest_memory = U.load_json(f"{ckpt_dir}/action/chest_memory.json")
         else:
             self.chest_memory = {}
-        if ollama:
-            self.llm = ChatOllama(
-                base_url=ollama_url,
-                model=model_name,
-                temperature=temperature,
-                timeout=request_timout,
-            )
-        else:
-            self.llm = ChatOpenAI(
-                model=model_name,
-                temperature=temperature,
-                timeout=request_timout,
-            )
+        self.llm = llm_registry.chat(
+            model_name, temperature=temperature, agent="action"
+        )
+        self.retry = llm_registry.retry
+        # token budget of the system message, None for no limit
+        self.prompt_token_budget = prompt_token_budget
+        self._token_counter = None
+        self.last_prompt_report = None
+        self.stream = stream
+
+    @property
+    def token_counter(self):
+        # loading a tiktoken encoding can block for seconds, e.g. offline,
+        # so only a token budget creates it
+        if self._token_counter is None:
+            self._token_counter = TokenCounter(self.model_name)
+        return self._token_counter
 
     def update_chest_memory(self, chests):
         for position, chest in chests.items():
@@ -112,17 +122,92 @@ class ActionAgent:
         #         "useChest",
         #         "mineflayer",
         #     ]
-        programs = "\n\n".join(load_control_primitives_context(base_skills) + skills)
         response_format = load_prompt("action_response_format")
         system_message_prompt = SystemMessagePromptTemplate.from_template(
             system_template
         )
+        primitives = load_control_primitives_context(base_skills)
+        if self.prompt_token_budget is None:
+            programs = primitives + [
+                skill if isinstance(skill, str) else skill["code"] for skill in skills
+            ]
+        else:
+            template_tokens = self.token_counter.count(
+                system_message_prompt.format(
+                    programs="", response_format=response_format
+                ).content
+            )
+            programs, self.last_prompt_report = self.assemble_programs(
+                primitives, skills, template_tokens
+            )
+            report = self.last_prompt_report
+            if report["described"] or report["dropped"]:
+                print(
+                    f"\033[32mAction Agent fitting {report['tokens']} tokens into a budget of {report['budget']}: "
+                    f"described {report['described']}, dropped {report['dropped']}\033[0m"
+                )
         system_message = system_message_prompt.format(
-            programs=programs, response_format=response_format
+            programs="\n\n".join(programs), response_format=response_format
         )
         assert isinstance(system_message, SystemMessage)
         return system_message
 
+    def assemble_programs(self, primitives, skills, template_tokens=0):
+        """
+        Fit the programs of the system message into the token budget. The
+        control primitives are always kept, then the skills are added in
+        order of relevance: with their full code if it fits, otherwise with
+        their short description, otherwise not at all.
+        skills are code strings or entries of SkillManager.retrieve_skill_entries.
+        Returns the programs and a report of the tokens per section and of
+        the skills that were described or dropped.
+        """
+        separator_tokens = self.token_counter.count("\n\n")
+        primitives_tokens = sum(
+            self.token_counter.count(primitive) + separator_tokens
+            for primitive in primitives
+        )
+        tokens = template_tokens + primitives_tokens
+        programs = list(primitives)
+        report = {
+            "budget": self.prompt_token_budget,
+            "exact": self.token_counter.exact,
+            "sections": {
+                "template": template_tokens,
+                "control_primitives": primitives_tokens,
+                "skills": 0,
+            },
+            "full": [],
+            "described": [],
+            "dropped": [],
+        }
+        for skill in skills:
+            if isinstance(skill, str):
+                skill = {"name": self.skill_name(skill), "code": skill}
+            candidates = [skill["code"]]
+            if skill.get("description"):
+                candidates.append(skill["description"])
+            for kind, program in zip(("full", "described"), candidates):
+                program_tokens = self.token_counter.count(program) + separator_tokens
+                if (
+                    self.prompt_token_budget is None
+                    or tokens + program_tokens <= self.prompt_token_budget
+                ):
+                    programs.append(program)
+                    tokens += program_tokens
+                    report["sections"]["skills"] += program_tokens
+                    report[kind].append(skill["name"])
+                    break
+            else:
+                report["dropped"].append(skill["name"])
+        report["tokens"] = tokens
+        return programs, report
+
+    @staticmethod
+    def skill_name(code):
+        match = re.search(r"async function (\w+)", code)
+        return match.group(1) if match else code[:30]
+
     def render_human_message(
         self, *, events, code="", task="", context="", critique=""
     ):
@@ -240,18 +325,62 @@ class ActionAgent:
 
         return HumanMessage(content=contents)
 
+    def generate(self, messages):
+        """
+        Query the action agent. When streaming, tokens are consumed as they
+        arrive and the generation stops as soon as the first javascript code
+        block is closed, skipping the trailing explanation. A stream that
+        breaks or ends without a complete code block is reported in
+        response_metadata["stream_error"] and process_ai_message fails fast.
+        Streams do not go through the cache of the model, so a cached
+        response is served here and a complete one is stored.
+        """
+        if not self.stream:
+            return self.llm.invoke(messages)
+        cache = getattr(self.llm, "cache", None)
+        if isinstance(cache, LLMCache):
+            prompt, llm_string = LLMCache.prompt_of(self.llm, messages)
+            cached = cache.lookup(prompt, llm_string)
+            if cached:
+                return cached[0].message
+        content = ""
+        error = None
+        chunks = self.llm.stream(messages)
+        try:
+            for chunk in chunks:
+                content += chunk.content
+                # a fence split over chunks still ends in this one
+                if "`" in chunk.content and self.CODE_PATTERN.search(content):
+                    break
+            else:
+                error = "the response ended without a complete javascript code block"
+        except Exception as e:
+            error = f"the response stream failed: {e}"
+        finally:
+            chunks.close()
+        if error:
+            return AIMessage(
+                content=content, response_metadata={"stream_error": error}
+            )
+        message = AIMessage(content=content)
+        if isinstance(cache, LLMCache):
+            cache.update(prompt, llm_string, [ChatGeneration(message=message)])
+        return message
+
     def process_ai_message(self, message):
         assert isinstance(message, AIMessage)
+        stream_error = message.response_metadata.get("stream_error")
+        if stream_error:
+            return f"Error parsing action response (before program execution): {stream_error}"
 
-        retry = 3
         error = None
-        while retry > 0:
+        max_attempts = 3
+        for attempt in range(max_attempts):
             try:
                 babel = require("@babel/core")
                 babel_generator = require("@babel/generator").default
 
-                code_pattern = re.compile(r"```(?:javascript|js)(.*?)```", re.DOTALL)
-                code = "\n".join(code_pattern.findall(message.content))
+                code = "\n".join(self.CODE_PATTERN.findall(message.content))
                 parsed = babel.parse(code)
                 functions = []
                 assert len(list(parsed.program.body)) > 0, "No functions found"
@@ -292,9 +421,12 @@ class ActionAgent:
                     "exec_code": exec_code,
                 }
             except Exception as e:
-                retry -= 1
                 error = e
-                time.sleep(1)
+                # only timeouts of the javascript bridge raise bare Exceptions,
+                # parse and assertion errors would fail the same way again
+                if type(e) is not Exception or attempt == max_attempts - 1:
+                    break
+                time.sleep(self.retry.delay(attempt))
         return f"Error parsing action response (before program execution): {error}"
 
     def summarize_chatlog(self, events):
@@ -1,9 +1,9 @@
 from voyager.prompts import load_prompt
 from voyager.utils.json_utils import fix_and_parse_json
 from voyager.utils.vision import get_vlm_images, format_api_query
-from langchain_openai import ChatOpenAI
 from langchain.schema import HumanMessage, SystemMessage
-from langchain_ollama import ChatOllama
+from voyager.llm import LLMRegistry
+from .task_rules import CountableTaskVerifier
 import re
 
 
@@ -19,28 +19,25 @@ class CriticAgent:
         temperature=0,
         request_timout=120,
         mode="auto",
+        llm_registry=None,
+        rules=True,
     ):
         # vision part
         self.use_vision = use_vision
         self.images_path = images_path
         self.nb_images_to_use = nb_images_to_use
-        self.ollama = ollama
-
-        if ollama:
-            self.llm = ChatOllama(
-                base_url=ollama_url,
-                model=model_name,
-                temperature=temperature,
-                timeout=request_timout,
-            )
-        else:
-            self.llm = ChatOpenAI(
-                model=model_name,
-                temperature=temperature,
-                timeout=request_timout,
-            )
+        if llm_registry is None:
+            llm_registry = LLMRegistry.from_options(ollama, ollama_url, request_timout)
+        self.ollama = llm_registry.ollama
+        self.llm = llm_registry.chat(
+            model_name, temperature=temperature, agent="critic"
+        )
         assert mode in ["auto", "manual"]
         self.mode = mode
+        # decide countable tasks without the LLM when possible
+        self.verifier = CountableTaskVerifier() if rules else None
+        self.rule_decisions = 0
+        self.llm_decisions = 0
 
     def render_system_message(self):
         system_message = SystemMessage(content=load_prompt("critic"))
@@ -129,34 +126,44 @@ class CriticAgent:
         return success, critique
 
     def ai_check_task_success(self, messages, max_retries=5):
-        if max_retries == 0:
-            print(
-                "\033[31mFailed to parse Critic Agent response. Consider updating your prompt.\033[0m"
-            )
-            return False, ""
-
         if messages[1] is None:
             return False, ""
 
-        critic = self.llm.invoke(messages).content
-        print(f"\033[31m****Critic Agent ai message****\n{critic}\033[0m")
-        try:
-            critic = re.sub(r"```[a-zA-Z]*\n?", "", critic).strip()
-            response = fix_and_parse_json(critic)
-            assert response["success"] in [True, False]
-            if "critique" not in response:
-                response["critique"] = ""
-            return response["success"], response["critique"]
-        except Exception as e:
-            print(f"\033[31mError parsing critic response: {e} Trying again!\033[0m")
-            return self.ai_check_task_success(
-                messages=messages,
-                max_retries=max_retries - 1,
+        # transient LLM errors are retried by the model, unparsable responses here
+        for _ in range(max_retries):
+            critic = self.llm.invoke(messages).content
+            print(f"\033[31m****Critic Agent ai message****\n{critic}\033[0m")
+            try:
+                critic = re.sub(r"```[a-zA-Z]*\n?", "", critic).strip()
+                response = fix_and_parse_json(critic)
+                assert response["success"] in [True, False]
+                if "critique" not in response:
+                    response["critique"] = ""
+                return response["success"], response["critique"]
+            except Exception as e:
+                print(f"\033[31mError parsing critic response: {e} Trying again!\033[0m")
+        print(
+            "\033[31mFailed to parse Critic Agent response. Consider updating your prompt.\033[0m"
+        )
+        return False, ""
+
+    def rule_check_task_success(self, *, events, task, baseline=None):
+        verdict = self.verifier.verify(task=task, events=events, baseline=baseline)
+        if verdict is not None:
+            self.rule_decisions += 1
+            success, critique = verdict
+            print(
+                f"\033[31m****Critic Agent rules****\nSuccess: {success}\nCritique: {critique}\033[0m"
             )
+        return verdict
 
     def check_task_success(
-        self, *, events, task, context, chest_observation, max_retries=5
+        self, *, events, task, context, chest_observation, max_retries=5, baseline=None
     ):
+        """
+        baseline is the observation before the task started, the rules use it
+        to tell what the task gained.
+        """
         human_message = self.render_human_message(
             events=events,
             task=task,
@@ -172,6 +179,13 @@ class CriticAgent:
         if self.mode == "manual":
             return self.human_check_task_success()
         elif self.mode == "auto":
+            if human_message is not None and self.verifier is not None:
+                verdict = self.rule_check_task_success(
+                    events=events, task=task, baseline=baseline
+                )
+                if verdict is not None:
+                    return verdict
+            self.llm_decisions += 1
             return self.ai_check_task_success(
                 messages=messages, max_retries=max_retries
             )
@@ -2,16 +2,17 @@ from __future__ import annotations
 
 import random
 import re
+import statistics
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import voyager.utils as U
 from voyager.prompts import load_prompt
 from voyager.utils.json_utils import fix_and_parse_json
-from langchain_openai import ChatOpenAI
-from langchain_ollama import ChatOllama
-from langchain_ollama import OllamaEmbeddings
-from langchain_openai import OpenAIEmbeddings
 from langchain.schema import HumanMessage, SystemMessage
 from langchain_chroma import Chroma
+from voyager.llm import LLMRegistry
 from voyager.utils.vision import get_vlm_images, format_api_query
 
 
@@ -33,44 +34,37 @@ class CurriculumAgent:
         mode="auto",
         warm_up=None,
         core_inventory_items: str | None = None,
+        llm_registry: LLMRegistry | None = None,
+        qa_max_workers: int = 4,
+        qa_cache_threshold: float = 0.05,
     ):
         # vision part
         self.use_vision = use_vision
         self.images_path = images_path
         self.nb_images_to_use = nb_images_to_use
-        self.ollama = ollama
-
-        if ollama:
-            self.embeddings = OllamaEmbeddings(model="mistral-small", base_url=ollama_url)
-            self.llm = ChatOllama(
-                base_url=ollama_url,
-                model=model_name,
-                temperature=temperature,
-                timeout=request_timout,
-            )
-            self.qa_llm = ChatOllama(
-                base_url=ollama_url,
-                model=qa_model_name,
-                temperature=qa_temperature,
-                timeout=request_timout,
-            )
-        else:
-            self.embeddings = OpenAIEmbeddings()
-            self.llm = ChatOpenAI(
-                model=model_name,
-                temperature=temperature,
-                timeout=request_timout,
-            )
-            self.qa_llm = ChatOpenAI(
-                model=qa_model_name,
-                temperature=qa_temperature,
-                timeout=request_timout,
-            )
+        if llm_registry is None:
+            llm_registry = LLMRegistry.from_options(ollama, ollama_url, request_timout)
+        self.ollama = llm_registry.ollama
+        self.embeddings = llm_registry.embeddings()
+        self.llm = llm_registry.chat(
+            model_name, temperature=temperature, agent="curriculum"
+        )
+        self.qa_llm = llm_registry.chat(
+            qa_model_name, temperature=qa_temperature, agent="curriculum_qa"
+        )
         assert mode in [
             "auto",
             "manual",
         ], f"mode {mode} not supported"
         self.mode = mode
+        self.qa_max_workers = qa_max_workers
+        # distance under which a cached question answers a new one
+        self.qa_cache_threshold = qa_cache_threshold
+        self.qa_cache_hits = 0
+        self.qa_cache_exact_hits = 0
+        self.qa_cache_misses = 0
+        # distance of the closest cached question of recent lookups
+        self.qa_cache_distances = deque(maxlen=1000)
         self.ckpt_dir = ckpt_dir
         U.f_mkdir(f"{ckpt_dir}/curriculum/vectordb")
         if resume:
@@ -338,23 +332,20 @@ class CurriculumAgent:
             raise ValueError(f"Invalid curriculum agent mode: {self.mode}")
 
     def propose_next_ai_task(self, *, messages, max_retries=5):
-        if max_retries == 0:
-            raise RuntimeError("Max retries reached, failed to propose ai task.")
-        curriculum = self.llm.invoke(messages).content
-        print(f"\033[31m****Curriculum Agent ai message****\n{curriculum}\033[0m")
-        try:
-            response = self.parse_ai_message(curriculum)
-            assert "next_task" in response
-            context = self.get_task_context(response["next_task"])
-            return response["next_task"], context
-        except Exception as e:
-            print(
-                f"\033[35mError parsing curriculum response: {e}. Trying again!\033[0m"
-            )
-            return self.propose_next_ai_task(
-                messages=messages,
-                max_retries=max_retries - 1,
-            )
+        # transient LLM errors are retried by the model, unparsable responses here
+        for _ in range(max_retries):
+            curriculum = self.llm.invoke(messages).content
+            print(f"\033[31m****Curriculum Agent ai message****\n{curriculum}\033[0m")
+            try:
+                response = self.parse_ai_message(curriculum)
+                assert "next_task" in response
+                context = self.get_task_context(response["next_task"])
+                return response["next_task"], context
+            except Exception as e:
+                print(
+                    f"\033[35mError parsing curriculum response: {e}. Trying again!\033[0m"
+                )
+        raise RuntimeError("Max retries reached, failed to propose ai task.")
 
     def parse_ai_message(self, message):
         task = ""
@@ -430,37 +421,134 @@ class CurriculumAgent:
         return fix_and_parse_json(response)
 
     def run_qa(self, *, events, chest_observation):
+        """
+        Answer the questions of QA step 1, in order. Questions are looked up
+        in the cache first with one embedding call and one vector query, the
+        misses, less near duplicates of each other, are answered concurrently
+        by at most qa_max_workers QA calls and the cache is written once.
+        """
         questions_new, _ = self.run_qa_step1_ask_questions(
             events=events, chest_observation=chest_observation
         )
-        questions = []
-        answers = []
-        for question in questions_new:
-            if self.qa_cache_questions_vectordb._collection.count() > 0:
-                docs_and_scores = (
-                    self.qa_cache_questions_vectordb.similarity_search_with_score(
-                        question, k=1
-                    )
+        cached, embeddings = self.lookup_qa_cache(questions_new)
+        # misses within qa_cache_threshold of an earlier miss share its answer
+        representatives = {}
+        misses = []
+        for question, hit in zip(questions_new, cached):
+            if hit is not None or question in representatives:
+                continue
+            representatives[question] = next(
+                (
+                    miss
+                    for miss in misses
+                    if _squared_l2(embeddings[question], embeddings[miss])
+                    < self.qa_cache_threshold
+                ),
+                question,
+            )
+            if representatives[question] == question:
+                misses.append(question)
+        if misses:
+            with ThreadPoolExecutor(
+                max_workers=min(self.qa_max_workers, len(misses))
+            ) as executor:
+                answers_new = list(
+                    executor.map(self.run_qa_step2_answer_questions, misses)
                 )
-                if docs_and_scores and docs_and_scores[0][1] < 0.05:
-                    question_cached = docs_and_scores[0][0].page_content
-                    assert question_cached in self.qa_cache
-                    answer_cached = self.qa_cache[question_cached]
-                    questions.append(question_cached)
-                    answers.append(answer_cached)
-                    continue
-            answer = self.run_qa_step2_answer_questions(question=question)
-            assert question not in self.qa_cache
-            self.qa_cache[question] = answer
-            self.qa_cache_questions_vectordb.add_texts(
-                texts=[question],
+            for question, answer in zip(misses, answers_new):
+                assert question not in self.qa_cache
+                self.qa_cache[question] = answer
+            # the embeddings of the lookup are reused
+            self.qa_cache_questions_vectordb._collection.upsert(
+                ids=[str(uuid.uuid4()) for _ in misses],
+                documents=misses,
+                embeddings=[embeddings[question] for question in misses],
             )
             U.dump_json(self.qa_cache, f"{self.ckpt_dir}/curriculum/qa_cache.json")
-            questions.append(question)
-            answers.append(answer)
+        questions = []
+        answers = []
+        for question, hit in zip(questions_new, cached):
+            if hit is None:
+                hit = representatives[question]
+            questions.append(hit)
+            answers.append(self.qa_cache[hit])
         assert len(questions_new) == len(questions) == len(answers)
         return questions, answers
 
+    def lookup_qa_cache(self, questions):
+        """
+        The cached question close enough to each question, or None, and the
+        embeddings of the questions that are not cached verbatim.
+        """
+        pending = list(
+            dict.fromkeys(
+                question for question in questions if question not in self.qa_cache
+            )
+        )
+        embeddings = {}
+        closest = {}
+        if pending:
+            embeddings = dict(
+                zip(pending, self.embeddings.embed_documents(pending))
+            )
+            if self.qa_cache_questions_vectordb._collection.count() > 0:
+                results = self.qa_cache_questions_vectordb._collection.query(
+                    query_embeddings=[embeddings[question] for question in pending],
+                    n_results=1,
+                    include=["documents", "distances"],
+                )
+                for question, documents, distances in zip(
+                    pending, results["documents"], results["distances"]
+                ):
+                    if documents:
+                        closest[question] = (documents[0], distances[0])
+                        self.qa_cache_distances.append(distances[0])
+        cached = []
+        for question in questions:
+            if question in self.qa_cache:
+                self.qa_cache_exact_hits += 1
+                cached.append(question)
+            elif (
+                question in closest
+                and closest[question][1] < self.qa_cache_threshold
+            ):
+                question_cached = closest[question][0]
+                assert question_cached in self.qa_cache
+                self.qa_cache_hits += 1
+                cached.append(question_cached)
+            else:
+                self.qa_cache_misses += 1
+                cached.append(None)
+        return cached, embeddings
+
+    def qa_cache_stats(self):
+        """Hit rate of the QA cache and distances to the closest cached question, to tune the threshold."""
+        lookups = self.qa_cache_exact_hits + self.qa_cache_hits + self.qa_cache_misses
+        distances = sorted(self.qa_cache_distances)
+        stats = {
+            "threshold": self.qa_cache_threshold,
+            "lookups": lookups,
+            "exact_hits": self.qa_cache_exact_hits,
+            "hits": self.qa_cache_hits,
+            "misses": self.qa_cache_misses,
+            "hit_rate": (self.qa_cache_exact_hits + self.qa_cache_hits) / lookups
+            if lookups
+            else 0.0,
+        }
+        if distances:
+            stats["distance"] = {
+                "min": distances[0],
+                "p10": distances[len(distances) // 10],
+                "median": statistics.median(distances),
+                "max": distances[-1],
+                # misses that a threshold twice as large would have answered
+                "under_2x_threshold": sum(
+                    self.qa_cache_threshold <= distance < 2 * self.qa_cache_threshold
+                    for distance in distances
+                ),
+            }
+        return stats
+
     def get_task_context(self, task):
         # if include ore in question, gpt will try to use tool with skill touch enhancement to mine
         question = (
@@ -542,3 +630,8 @@ class CurriculumAgent:
         qa_answer = self.qa_llm.invoke(messages).content
         print(f"\033[31mCurriculum Agent {qa_answer}\033[0m")
         return qa_answer
+
+
+def _squared_l2(a, b):
+    # the distance of the default l2 space of Chroma collections
+    return sum((x - y) ** 2 for x, y in zip(a, b))
@@ -1,13 +1,10 @@
 import os
 
 import voyager.utils as U
-from langchain_openai import ChatOpenAI
-from langchain_openai import OpenAIEmbeddings
-from langchain_ollama import OllamaEmbeddings
 from langchain.schema import HumanMessage, SystemMessage
 from langchain_chroma import Chroma
-from langchain_ollama import ChatOllama
 
+from voyager.llm import LLMRegistry
 from voyager.prompts import load_prompt
 from voyager.control_primitives import load_control_primitives
 from voyager.utils.vision import get_vlm_images, format_api_query
@@ -27,29 +24,20 @@ class SkillManager:
         request_timout=120,
         ckpt_dir="ckpt",
         resume=False,
+        llm_registry=None,
     ):
         
         # vision part
         self.use_vision = use_vision
         self.images_path = images_path
         self.nb_images_to_use = nb_images_to_use
-        self.ollama = ollama
-
-        if ollama:
-            self.embeddings = OllamaEmbeddings(model="mistral-small", base_url=ollama_url)
-            self.llm = ChatOllama(
-                base_url=ollama_url,
-                model=model_name,
-                temperature=temperature,
-                timeout=request_timout,
-            )
-        else:
-            self.embeddings = OpenAIEmbeddings()
-            self.llm = ChatOpenAI(
-                model=model_name,
-                temperature=temperature,
-                timeout=request_timout,
-            )
+        if llm_registry is None:
+            llm_registry = LLMRegistry.from_options(ollama, ollama_url, request_timout)
+        self.ollama = llm_registry.ollama
+        self.embeddings = llm_registry.embeddings()
+        self.llm = llm_registry.chat(
+            model_name, temperature=temperature, agent="skill"
+        )
         U.f_mkdir(f"{ckpt_dir}/skill/code")
         U.f_mkdir(f"{ckpt_dir}/skill/description")
         U.f_mkdir(f"{ckpt_dir}/skill/vectordb")
@@ -75,14 +63,15 @@ class SkillManager:
         )
 
     @property
-    def programs(self):
-        programs = ""
-        for skill_name, entry in self.skills.items():
-            programs += f"{entry['code']}\n\n"
-        for primitives in self.control_primitives:
-            programs += f"{primitives}\n\n"
+    def program_list(self):
+        programs = [entry["code"] for entry in self.skills.values()]
+        programs.extend(self.control_primitives)
         return programs
 
+    @property
+    def programs(self):
+        return "".join(f"{program}\n\n" for program in self.program_list)
+
     def add_new_skill(self, info):
         if info["task"].startswith("Deposit useless items into the chest at"):
             # No need to reuse the deposit skill
@@ -148,6 +137,13 @@ class SkillManager:
         return f"async function {program_name}(bot) {{\n{skill_description}\n}}"
 
     def retrieve_skills(self, query):
+        return [entry["code"] for entry in self.retrieve_skill_entries(query)]
+
+    def retrieve_skill_entries(self, query):
+        """
+        Retrieved skills, most relevant first, as dicts with the name, code,
+        description and distance of each skill.
+        """
         k = min(self.vectordb._collection.count(), self.retrieval_top_k)
         if k == 0:
             return []
@@ -157,7 +153,15 @@ class SkillManager:
             f"\033[33mSkill Manager retrieved skills: "
             f"{', '.join([doc.metadata['name'] for doc, _ in docs_and_scores])}\033[0m"
         )
-        skills = []
-        for doc, _ in docs_and_scores:
-            skills.append(self.skills[doc.metadata["name"]]["code"])
-        return skills
+        entries = []
+        for doc, score in docs_and_scores:
+            name = doc.metadata["name"]
+            entries.append(
+                {
+                    "name": name,
+                    "code": self.skills[name]["code"],
+                    "description": self.skills[name]["description"],
+                    "distance": score,
+                }
+            )
+        return entries
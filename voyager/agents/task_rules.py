@@ -0,0 +1,189 @@
+import re
+
+from voyager.env import ObservationDelta
+
+
+class CountableTaskVerifier:
+    """
+    Decide "Mine N X", "Craft N X", "Smelt N X" / "Cook N X" and "Kill N X"
+    tasks without the critic LLM. Like the critic prompt, Mine, Craft and
+    Smelt tasks succeed when the final inventory (plus armor and offhand)
+    holds N matching items, Kill tasks when killMob reported N kills of the
+    mob in the last step. verify() returns None whenever the rules cannot
+    tell, e.g. an item name they do not recognize, and the LLM decides.
+    """
+
+    TASK_PATTERN = re.compile(
+        r"^(mine|craft|smelt|cook|kill)\s+(\d+|an?|one)\s+(.+?)\.?$", re.IGNORECASE
+    )
+    # items standing for a family of items
+    ALIASES = {
+        "log": r".*_log",
+        "wood": r".*_log",
+        "wood_log": r".*_log",
+        "wooden_log": r".*_log",
+        "plank": r".*_planks",
+        "wood_plank": r".*_planks",
+        "wooden_plank": r".*_planks",
+        "wool": r".*_wool",
+        "bed": r".*_bed",
+    }
+    # what mining a block gives, besides the block itself
+    MINE_DROPS = {
+        "stone": ["cobblestone"],
+        "deepslate": ["cobbled_deepslate"],
+        "grass_block": ["dirt"],
+        "coal_ore": ["coal"],
+        "iron_ore": ["raw_iron"],
+        "gold_ore": ["raw_gold"],
+        "copper_ore": ["raw_copper"],
+        "diamond_ore": ["diamond"],
+        "emerald_ore": ["emerald"],
+        "lapis_ore": ["lapis_lazuli"],
+        "redstone_ore": ["redstone"],
+        "nether_quartz_ore": ["quartz"],
+        "gravel": ["flint"],
+        "clay": ["clay_ball"],
+        "snow": ["snowball"],
+    }
+    # what smelting or cooking an item gives
+    SMELT_PRODUCTS = {
+        "raw_iron": "iron_ingot",
+        "iron_ore": "iron_ingot",
+        "iron": "iron_ingot",
+        "raw_gold": "gold_ingot",
+        "gold_ore": "gold_ingot",
+        "gold": "gold_ingot",
+        "raw_copper": "copper_ingot",
+        "copper_ore": "copper_ingot",
+        "copper": "copper_ingot",
+        "sand": "glass",
+        "cobblestone": "stone",
+        "clay_ball": "brick",
+        "beef": "cooked_beef",
+        "steak": "cooked_beef",
+        "porkchop": "cooked_porkchop",
+        "chicken": "cooked_chicken",
+        "mutton": "cooked_mutton",
+        "rabbit": "cooked_rabbit",
+        "cod": "cooked_cod",
+        "salmon": "cooked_salmon",
+        "potato": "baked_potato",
+    }
+    RAW_FOODS = (
+        "raw_beef",
+        "raw_porkchop",
+        "raw_chicken",
+        "raw_mutton",
+        "raw_cod",
+        "raw_salmon",
+    )
+    # armor and offhand, the main hand item is also in the inventory
+    EQUIPMENT_SLOTS = (0, 1, 2, 3, 5)
+
+    def verify(self, *, task, events, baseline=None):
+        match = self.TASK_PATTERN.match(task.strip())
+        if not match:
+            return None
+        verb, quantity, name = match.groups()
+        verb = verb.lower()
+        quantity = int(quantity) if quantity.isdigit() else 1
+        observation = events[-1][1]
+        if verb == "kill":
+            return self.verify_kill(quantity, self.normalize(name), events)
+        known = set(observation["inventory"]) | set(
+            item for item in observation["status"]["equipment"] if item
+        )
+        if baseline is not None:
+            known |= set(baseline["inventory"])
+        for candidate in self.singular_forms(self.normalize(name)):
+            target = self.item_pattern(verb, candidate, known)
+            if target is not None:
+                break
+        else:
+            return None
+        pattern, name = target
+        count = self.count_items(pattern, observation)
+        if count >= quantity:
+            return True, ""
+        critique = f"You need {quantity} {name} but only have {count}."
+        if baseline is not None:
+            gained = sum(
+                value
+                for item, value in ObservationDelta.between(
+                    baseline, observation
+                ).gained.items()
+                if pattern.fullmatch(item)
+            )
+            critique += f" You got {gained} during this task."
+        critique += f" {verb.capitalize()} {quantity - count} more {name}."
+        return False, critique
+
+    def verify_kill(self, quantity, mob, events):
+        for candidate in self.singular_forms(mob):
+            kills = sum(
+                1
+                for event_type, event in events
+                if event_type == "onSave" and event["onSave"] == f"{candidate}_killed"
+            )
+            if kills >= quantity:
+                return True, ""
+            not_found = f"No {candidate} nearby, please explore first"
+            if kills == 0 and any(
+                event_type == "onChat" and event["onChat"] == not_found
+                for event_type, event in events
+            ):
+                return (
+                    False,
+                    f"There is no {candidate} nearby, explore to find one first.",
+                )
+        # kills of earlier attempts are not in these events
+        return None
+
+    def item_pattern(self, verb, name, known):
+        """Pattern of the item names that count for the task and the name of the target."""
+        if name in self.ALIASES:
+            return re.compile(self.ALIASES[name]), name
+        if verb == "mine":
+            base = name[len("deepslate_") :] if name.startswith("deepslate_") else name
+            if base in self.MINE_DROPS or name in known:
+                items = [name] + self.MINE_DROPS.get(base, [])
+                return re.compile("|".join(map(re.escape, items))), name
+        elif verb in ("smelt", "cook"):
+            name = self.SMELT_PRODUCTS.get(name, name)
+            if name in self.SMELT_PRODUCTS.values() or name in known:
+                return re.compile(re.escape(name)), name
+        elif name in known:
+            return re.compile(re.escape(name)), name
+        return None
+
+    def count_items(self, pattern, observation):
+        count = sum(
+            value
+            for item, value in observation["inventory"].items()
+            if pattern.fullmatch(item)
+        )
+        equipment = observation["status"]["equipment"]
+        count += sum(
+            1
+            for slot in self.EQUIPMENT_SLOTS
+            if slot < len(equipment)
+            and equipment[slot]
+            and pattern.fullmatch(equipment[slot])
+        )
+        return count
+
+    @classmethod
+    def normalize(cls, name):
+        name = name.strip().lower().replace(" ", "_")
+        # the raw foods are named after the animal
+        return name[len("raw_") :] if name in cls.RAW_FOODS else name
+
+    @staticmethod
+    def singular_forms(name):
+        forms = [name]
+        if name.endswith("es"):
+            forms.append(name[:-2])
+        if name.endswith("s"):
+            forms.append(name[:-1])
+        return forms
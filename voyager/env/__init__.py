@@ -1 +1,5 @@
 from .bridge import VoyagerEnv
+from .async_bridge import AsyncVoyagerEnv
+from .pool import VoyagerEnvPool
+from .observation import Event, Observation, ObservationDelta
+from .mock import MockVoyagerEnv, ReplayVoyagerEnv
@@ -0,0 +1,82 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from .bridge import VoyagerEnv
+
+
+class AsyncVoyagerEnv:
+    """
+    asyncio front-end of VoyagerEnv with the same reset/step/close semantics.
+    Blocking calls run on a single worker thread per environment, so requests
+    to one mineflayer server never interleave while the event loop stays free
+    for LLM calls or other bots. Process supervision is the one of the wrapped
+    VoyagerEnv (SubprocessMonitor).
+    """
+
+    def __init__(self, *args, step_timeout=None, reset_timeout=None, **kwargs):
+        self.env = VoyagerEnv(*args, **kwargs)
+        self.step_timeout = step_timeout
+        self.reset_timeout = reset_timeout
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix=f"voyager-env-{self.env.server_port}"
+        )
+        self._lock = None
+
+    @property
+    def mineflayer(self):
+        return self.env.mineflayer
+
+    @property
+    def has_reset(self):
+        return self.env.has_reset
+
+    async def astep(self, code, programs="", timeout=None):
+        timeout = timeout if timeout is not None else self.step_timeout
+        return await self._call(self.env.step, code, programs=programs, timeout=timeout)
+
+    async def areset(self, *, seed=None, options=None, timeout=None):
+        timeout = timeout if timeout is not None else self.reset_timeout
+        return await self._call(
+            self.env.reset, seed=seed, options=options, timeout=timeout
+        )
+
+    async def aclose(self):
+        try:
+            return await self._call(self.env.close, timeout=None)
+        finally:
+            self._executor.shutdown(wait=False)
+
+    def latency_stats(self):
+        return self.env.latency_stats()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def _call(self, fn, *args, timeout=None, **kwargs):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(
+                self._executor, functools.partial(fn, *args, **kwargs)
+            )
+            try:
+                return await asyncio.wait_for(future, timeout)
+            except (asyncio.CancelledError, asyncio.TimeoutError):
+                self._abandon(loop)
+                raise
+
+    def _abandon(self, loop):
+        # The worker thread is blocked inside a request that cannot be
+        # interrupted, and the program keeps running on the server. Stopping
+        # mineflayer drops the connection so the worker returns, and the next
+        # call restarts the process through check_process like after a crash.
+        print(
+            f"\033[31mMineflayer request on port {self.env.server_port} "
+            f"cancelled, restarting mineflayer\033[0m"
+        )
+        loop.run_in_executor(None, self.env.mineflayer.stop)
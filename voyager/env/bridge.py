@@ -1,18 +1,29 @@
+import hashlib
+import json
 import os.path
+import re
 import time
 import warnings
 from typing import SupportsFloat, Any, Tuple, Dict
 
-import requests
-import json
-
 import gymnasium as gym
 from gymnasium.core import ObsType
 
 import voyager.utils as U
 
 from .minecraft_launcher import MinecraftInstance
-from .process_monitor import SubprocessMonitor
+from .observation import (
+    WIRE_FORMAT,
+    WIRE_HEADER,
+    DeltaState,
+    Event,
+    Observation,
+    ObservationDelta,
+    build_events,
+    decode_events,
+)
+from .process_monitor import ProcessSupervisor, ResourceSampler, SubprocessMonitor
+from .transport import HttpTransport, TrafficRecorder
 
 
 class VoyagerEnv(gym.Env):
@@ -24,6 +35,18 @@ class VoyagerEnv(gym.Env):
         server_port=3000,
         request_timeout=600,
         log_path="./logs",
+        endpoint_timeouts=None,
+        retry_policies=None,
+        username="bot",
+        wire_format=WIRE_FORMAT,
+        use_warm_reset=True,
+        record_path=None,
+        delta_observations=False,
+        fold_pause=True,
+        hot_standby=False,
+        standby_port=None,
+        resource_sample_interval=None,
+        resource_ceilings=None,
     ):
         if not mc_port and not azure_login:
             raise ValueError("Either mc_port or azure_login must be specified")
@@ -33,22 +56,76 @@ class VoyagerEnv(gym.Env):
             )
         self.mc_port = mc_port
         self.azure_login = azure_login
+        self.server_host = server_host
         self.server = f"{server_host}:{server_port}"
         self.server_port = server_port
         self.request_timeout = request_timeout
         self.log_path = log_path
-        self.mineflayer = self.get_mineflayer_process(server_port)
+        self.username = username
+        self.use_warm_reset = use_warm_reset
+        # let /step and /reset pause the world themselves instead of separate
+        # /pause requests around them
+        self.fold_pause = fold_pause
+        self.transport = HttpTransport(
+            self.server,
+            default_timeout=request_timeout,
+            timeouts={"/pause": 60, "/stop": 60, **(endpoint_timeouts or {})},
+            retry_policies=retry_policies,
+            recorder=TrafficRecorder(record_path) if record_path else None,
+        )
+        # servers that do not know the format answer with legacy json
+        if wire_format:
+            self.transport.session.headers[WIRE_HEADER] = wire_format
+        if hot_standby:
+            # a second mineflayer process waits on standby_port to replace the
+            # active one when it dies, the two swap roles on every crash
+            self.mineflayer = ProcessSupervisor(
+                self.get_mineflayer_process,
+                [server_port, standby_port or server_port + 1000],
+            )
+        else:
+            self.mineflayer = self.get_mineflayer_process(server_port)
         if azure_login:
             self.mc_instance = self.get_mc_instance()
         else:
             self.mc_instance = None
+        self.resources = None
+        if resource_sample_interval or resource_ceilings:
+            # ceilings map "mineflayer" or "minecraft" to limits of
+            # ResourceSampler.METRICS, a process over them restarts on reset
+            self.resources = ResourceSampler(
+                {
+                    "mineflayer": self.mineflayer,
+                    "minecraft": self.mc_instance.mc_process
+                    if self.mc_instance
+                    else None,
+                },
+                interval=resource_sample_interval or 5.0,
+                ceilings=resource_ceilings,
+            ).start()
         self.has_reset = False
         self.reset_options = None
         self.connected = False
+        # None while a folded step or reset may have left it either way
         self.server_paused = False
+        # hashes of the programs the current mineflayer process already holds
+        self.registered_programs = set()
+        self._program_hashes = {}
+        self._program_names = {}
+        # the server sends only the changes against the last acknowledged
+        # observation, needs the compact wire format
+        self.delta = DeltaState() if delta_observations and wire_format else None
+        self.last_observation = None
+        self.last_delta = None
+
+    def mineflayer_name(self, server_port):
+        if server_port == self.server_port:
+            return "mineflayer"
+        return f"mineflayer_{server_port}"
 
     def get_mineflayer_process(self, server_port):
-        U.f_mkdir(self.log_path, "mineflayer")
+        name = self.mineflayer_name(server_port)
+        U.f_mkdir(self.log_path, name)
         file_path = os.path.abspath(os.path.dirname(__file__))
         return SubprocessMonitor(
             commands=[
@@ -56,9 +133,9 @@ class VoyagerEnv(gym.Env):
                 U.f_join(file_path, "mineflayer/index.js"),
                 str(server_port),
             ],
-            name="mineflayer",
+            name=name,
             ready_match=r"Server started on port (\d+)",
-            log_path=U.f_join(self.log_path, "mineflayer"),
+            log_path=U.f_join(self.log_path, name),
         )
 
     def get_mc_instance(self):
@@ -68,6 +145,7 @@ class VoyagerEnv(gym.Env):
             **self.azure_login,
             mineflayer=self.mineflayer,
             log_path=U.f_join(self.log_path, "minecraft"),
+            username=self.username,
         )
 
     def check_process(self):
@@ -80,49 +158,240 @@ class VoyagerEnv(gym.Env):
             self.mc_port = self.mc_instance.port
             self.reset_options["port"] = self.mc_instance.port
             print(f"Server started on port {self.reset_options['port']}")
+        if self.mineflayer.is_running and not self.has_reset:
+            # spawned ahead, e.g. by VoyagerEnvPool.start, without a bot yet
+            return self.start_bot()
         retry = 0
         while not self.mineflayer.is_running:
             print("Mineflayer process has exited, restarting")
             self.mineflayer.run()
             if not self.mineflayer.is_running:
-                if retry > 3:
-                    raise RuntimeError("Mineflayer process failed to start")
-                else:
-                    continue
+                if retry >= 3:
+                    raise self.mineflayer_error("Mineflayer process failed to start")
+                time.sleep(min(0.5 * 2**retry, 5))
+                retry += 1
+                continue
             print(self.mineflayer.ready_line)
-            res = requests.post(
-                f"{self.server}/start",
-                json=self.reset_options,
-                timeout=self.request_timeout,
+            return self.start_bot()
+
+    def start_bot(self):
+        """Start the bot on the running mineflayer process."""
+        self.follow_port()
+        self.transport.reset_connections()
+        # a fresh mineflayer process starts with an empty program registry
+        self.registered_programs = set()
+        res = self.transport.post(
+            "/start",
+            json=self.with_delta(
+                {**self.reset_options, "paused": self.server_paused is True}
+            ),
+        )
+        if res.status_code != 200:
+            self.mineflayer.stop()
+            raise self.mineflayer_error(
+                f"Minecraft server reply with code {res.status_code}"
+            )
+        return self.observed(decode_events(res, self.delta), reset=True)
+
+    def mineflayer_error(self, message):
+        """RuntimeError with the recent mineflayer output attached."""
+        tail = self.mineflayer.tail()
+        if tail:
+            message = f"{message}\nRecent {self.mineflayer.name} output:\n{tail}"
+        return RuntimeError(message)
+
+    def follow_port(self):
+        """Point requests at the port of the active mineflayer process."""
+        port = getattr(self.mineflayer, "port", self.server_port)
+        if port != self.server_port:
+            self.server_port = port
+            self.server = f"{self.server_host}:{port}"
+            self.transport.base_url = self.server
+
+    def with_delta(self, data):
+        if self.delta is None:
+            return data
+        return {**data, **self.delta.request_fields()}
+
+    def observed(self, events, reset=False):
+        """Track the final observation and its delta to the previous one."""
+        observation = events[-1].data
+        if reset or self.last_observation is None:
+            self.last_delta = None
+        else:
+            self.last_delta = ObservationDelta.between(
+                self.last_observation, observation
             )
+        self.last_observation = observation
+        return events
+
+    def program_hash(self, program):
+        if program not in self._program_hashes:
+            self._program_hashes[program] = hashlib.sha256(
+                program.encode("utf-8")
+            ).hexdigest()[:32]
+        return self._program_hashes[program]
+
+    FUNCTION_PATTERN = re.compile(r"^(?:async\s+)?function\s*\*?\s*([\w$]+)", re.M)
+    IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_$][\w$]*")
+
+    def used_programs(self, code, programs):
+        """
+        The programs whose top level functions the code calls, directly or
+        through other programs, in their original order.
+        """
+        defined = {}
+        for program in programs:
+            if program not in self._program_names:
+                self._program_names[program] = self.FUNCTION_PATTERN.findall(program)
+            for name in self._program_names[program]:
+                # like in JavaScript, the last definition wins
+                defined[name] = program
+        used = set()
+        pending = [code]
+        while pending:
+            for name in set(self.IDENTIFIER_PATTERN.findall(pending.pop())):
+                program = defined.get(name)
+                if program is not None and program not in used:
+                    used.add(program)
+                    pending.append(program)
+        return [program for program in programs if program in used]
+
+    def register_programs(self, programs, force=False):
+        """
+        Upload the programs the server does not hold yet, keyed by content hash.
+        Returns the hashes of all programs in order.
+        """
+        hashes = [self.program_hash(program) for program in programs]
+        missing = {
+            program_hash: program
+            for program_hash, program in zip(hashes, programs)
+            if force or program_hash not in self.registered_programs
+        }
+        if missing:
+            res = self.transport.post("/programs", json={"programs": missing})
             if res.status_code != 200:
-                self.mineflayer.stop()
-                raise RuntimeError(
-                    f"Minecraft server reply with code {res.status_code}"
-                )
-            return res.json()
+                raise RuntimeError("Failed to register programs on Minecraft server")
+            self.registered_programs.update(missing)
+        return hashes
 
     def step(
         self,
         code: str,
-        programs: str = "",
+        programs="",
+        abort_on=None,
     ) -> Tuple[ObsType, SupportsFloat, bool, bool, Dict[str, Any]]:
+        """
+        programs is either the concatenated source of all programs or a list of
+        program sources. A list is registered once on the server and each step
+        only sends the content hashes of the programs the code uses.
+        abort_on is an optional predicate on streamed events, the running
+        program is aborted the first time it returns True.
+        """
+        if abort_on is not None:
+            stream = self.stream_step(code, programs=programs)
+            aborted = False
+            while True:
+                try:
+                    event = next(stream)
+                except StopIteration as stop:
+                    return stop.value
+                if not aborted and abort_on(event):
+                    print(f"\033[31mAborting program on {event.type}\033[0m")
+                    self.abort()
+                    aborted = True
+        res = self.post_step(code, programs)
+        if res.status_code != 200:
+            raise self.mineflayer_error("Failed to step Minecraft server")
+        events = self.observed(decode_events(res, self.delta))
+        self.paused_after()
+        return events
+
+    def stream_step(self, code: str, programs=""):
+        """
+        Generator version of step. It yields the onChat/onError/onSave events
+        as they happen on the server, carrying only their own field, and
+        returns the full event list like step. Streamed onError events also
+        report control primitives giving up after too many misses and onStuck
+        ones a bot making no progress, neither is in the final events.
+        Closing the generator early aborts the running program.
+        """
+        res = self.post_step(code, programs, stream=True)
+        if res.status_code != 200:
+            res.close()
+            raise self.mineflayer_error("Failed to step Minecraft server")
+        events = None
+        raw_lines = []
+        lines = res.iter_lines()
+        try:
+            for line in lines:
+                if not line:
+                    continue
+                raw_lines.append(line)
+                message = json.loads(line)
+                if "event" in message:
+                    event_type, payload = message["event"]
+                    yield Event(event_type, Observation(payload))
+                elif "events" in message:
+                    events = self.build_final_events(message)
+        except GeneratorExit:
+            self.abort()
+            for line in lines:
+                if line and line.startswith(b'{"events"'):
+                    raw_lines.append(line)
+                    events = self.observed(self.build_final_events(json.loads(line)))
+            raise
+        finally:
+            res.close()
+            if self.transport.recorder:
+                self.transport.recorder.record(
+                    "/step",
+                    json.loads(res.request.body),
+                    res.status_code,
+                    b"\n".join(raw_lines).decode("utf-8"),
+                    wire=res.headers.get(WIRE_HEADER),
+                    stream=True,
+                )
+            if events is not None:
+                self.paused_after()
+        if events is None:
+            raise self.mineflayer_error(
+                "Minecraft server closed the step stream early"
+            )
+        return self.observed(events)
+
+    def build_final_events(self, message):
+        if self.delta is not None and "seq" in message:
+            return self.delta.build(message["events"], message["seq"], message["base"])
+        return build_events(message["events"])
+
+    def post_step(self, code, programs, stream=False):
         if not self.has_reset:
             raise RuntimeError("Environment has not been reset yet")
         self.check_process()
-        self.unpause()
-        data = {
-            "code": code,
-            "programs": programs,
-        }
-        res = requests.post(
-            f"{self.server}/step", json=data, timeout=self.request_timeout
-        )
-        if res.status_code != 200:
-            raise RuntimeError("Failed to step Minecraft server")
-        returned_data = res.json()
-        self.pause()
-        return json.loads(returned_data)
+        data = self.with_delta({"code": code, "stream": stream})
+        if self.fold_pause:
+            data.update(unpause=True, pause=True)
+            self.server_paused = None
+        else:
+            self.unpause()
+        if isinstance(programs, str):
+            data["programs"] = programs
+        else:
+            programs = self.used_programs(code, programs)
+            data["programHashes"] = self.register_programs(programs)
+        res = self.transport.post("/step", json=data, stream=stream)
+        if res.status_code == 409 and "programHashes" in data:
+            # the server lost (part of) its registry, upload again and retry once
+            self.registered_programs.difference_update(res.json()["missing"])
+            self.register_programs(programs)
+            res = self.transport.post("/step", json=data, stream=stream)
+        return res
+
+    def abort(self):
+        """Abort the program of the running step, it returns right away."""
+        res = self.transport.post("/abort")
+        return res.status_code == 200 and res.json()["aborted"]
 
     def render(self):
         raise NotImplementedError("render is not implemented")
@@ -139,6 +408,7 @@ class VoyagerEnv(gym.Env):
         if options.get("inventory", {}) and options.get("mode", "hard") != "hard":
             raise RuntimeError("inventory can only be set when options is hard")
 
+        previous_options = self.reset_options
         self.reset_options = {
             "port": self.mc_port,
             "reset": options.get("mode", "hard"),
@@ -147,41 +417,153 @@ class VoyagerEnv(gym.Env):
             "spread": options.get("spread", False),
             "waitTicks": options.get("wait_ticks", 5),
             "position": options.get("position", None),
+            "username": self.username,
         }
 
-        self.unpause()
-        self.mineflayer.stop()
-        time.sleep(1)  # wait for mineflayer to exit
+        # restart processes that grew over their ceilings now, between tasks
+        over_ceiling = self.resources.needs_restart() if self.resources else {}
+        for name, reason in over_ceiling.items():
+            print(
+                f"\033[33m{name} is over its resource ceiling ({reason}), "
+                f"restarting\033[0m"
+            )
+
+        if (
+            self.use_warm_reset
+            and not over_ceiling
+            and self.reset_options["reset"] == "soft"
+            and self.can_warm_reset(previous_options)
+        ):
+            events = self.warm_reset()
+            if events is not None:
+                return events
 
-        returned_data = self.check_process()
+        if self.has_reset or over_ceiling:
+            self.unpause()
+            self.mineflayer.stop()
+            if "minecraft" in over_ceiling and self.mc_instance:
+                self.mc_instance.stop()
+            time.sleep(1)  # wait for mineflayer to exit
+
+        events = self.check_process()
+        for name in over_ceiling:
+            self.resources.restarted(name)
         self.has_reset = True
         self.connected = True
         # All the reset in step will be soft
         self.reset_options["reset"] = "soft"
         self.pause()
-        return json.loads(returned_data)
+        return events
+
+    def can_warm_reset(self, previous_options):
+        return (
+            self.connected
+            and self.has_reset
+            and self.mineflayer.is_running
+            and (self.mc_instance is None or self.mc_instance.is_running)
+            and previous_options is not None
+            and previous_options["port"] == self.reset_options["port"]
+        )
+
+    def warm_reset(self):
+        """
+        Reset the episode on the running mineflayer process without respawning
+        Node or reconnecting the bot. Returns None if the server refused, in
+        which case the caller falls back to a cold restart.
+        """
+        data = self.with_delta(self.reset_options)
+        if self.fold_pause:
+            data = {**data, "unpause": True, "pause": True}
+            self.server_paused = None
+        else:
+            self.unpause()
+        try:
+            res = self.transport.post("/reset", json=data)
+        except Exception as e:
+            print(f"\033[33mWarm reset failed ({e}), restarting mineflayer\033[0m")
+            return None
+        if res.status_code != 200:
+            print(
+                f"\033[33mWarm reset failed with code {res.status_code}, "
+                f"restarting mineflayer\033[0m"
+            )
+            return None
+        events = decode_events(res, self.delta)
+        stale = self.stale_task_state(events[-1].data)
+        if stale:
+            print(
+                f"\033[33mWarm reset kept {', '.join(stale)} of the previous task, "
+                f"restarting mineflayer\033[0m"
+            )
+            return None
+        events = self.observed(events, reset=True)
+        self.paused_after()
+        return events
+
+    @staticmethod
+    def stale_task_state(observation):
+        """
+        Fields of a reset observation still holding state of the previous
+        task. The mineflayer server and the mock both start a task with no
+        block records beyond the surrounding blocks and no chest contents.
+        """
+        stale = []
+        if not set(observation["blockRecords"]) <= set(observation["voxels"]):
+            stale.append("blockRecords")
+        if any(
+            isinstance(items, dict) and items
+            for items in observation["nearbyChests"].values()
+        ):
+            stale.append("nearbyChests")
+        return stale
+
+    def paused_after(self):
+        """Pause after a successful step or warm reset."""
+        if self.fold_pause:
+            # the server pauses right after responding
+            self.server_paused = True
+        else:
+            self.pause()
 
     def close(self):
         self.unpause()
         if self.connected:
-            res = requests.post(f"{self.server}/stop")
+            res = self.transport.post("/stop")
             if res.status_code == 200:
                 self.connected = False
+        if self.resources:
+            self.resources.stop()
         if self.mc_instance:
             self.mc_instance.stop()
-        self.mineflayer.stop()
+        self.mineflayer.close()
+        self.transport.close()
         return not self.connected
 
     def pause(self):
-        if self.mineflayer.is_running and not self.server_paused:
-            res = requests.post(f"{self.server}/pause")
+        if self.mineflayer.is_running and self.server_paused is not True:
+            res = self.transport.post("/pause", json={"paused": True})
             if res.status_code == 200:
                 self.server_paused = True
         return self.server_paused
 
+    def is_healthy(self, timeout=5):
+        if not self.mineflayer.is_running:
+            return False
+        try:
+            res = self.transport.probe("/health", timeout=timeout)
+        except Exception:
+            return False
+        return res.status_code == 200
+
+    def latency_stats(self):
+        return self.transport.latency_stats()
+
+    def resource_stats(self):
+        return self.resources.stats() if self.resources else {}
+
     def unpause(self):
-        if self.mineflayer.is_running and self.server_paused:
-            res = requests.post(f"{self.server}/pause")
+        if self.mineflayer.is_running and self.server_paused is not False:
+            res = self.transport.post("/pause", json={"paused": False})
             if res.status_code == 200:
                 self.server_paused = False
             else:
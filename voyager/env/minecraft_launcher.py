@@ -17,6 +17,7 @@ class MinecraftInstance:
         version,
         mineflayer,
         log_path="logs",
+        username="bot",
     ):
         self.client_id = client_id
         self.redirect_url = redirect_url
@@ -40,7 +41,7 @@ class MinecraftInstance:
             ready_match=r"Started serving on (\d+)",
             log_path=self.log_path,
             callback=stop_mineflayer,
-            callback_match=r"\[Server thread/INFO\]: bot left the game",
+            callback_match=rf"\[Server thread/INFO\]: {re.escape(username)} left the game",
             finished_callback=stop_mineflayer,
         )
 
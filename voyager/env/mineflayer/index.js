@@ -22,6 +22,62 @@ const { plugin: tool } = require("mineflayer-tool");
 
 let bot = null;
 
+// content-addressed program registry, filled by /programs and used by /step
+const programStore = new Map();
+// evaluated program lines start after the "function anonymous(scope) {" and
+// "with (scope) {" lines
+const PROGRAM_LINE_OFFSET = 3;
+
+// observation wire format negotiated through the X-Voyager-Wire header
+const WIRE_FORMAT = "events/1";
+
+// the step currently running, so /abort can reach it
+let currentStep = null;
+
+// whether the Minecraft world is paused, "/pause" only toggles it
+let worldPaused = false;
+
+function setPaused(paused) {
+    if (worldPaused === paused) return false;
+    bot.chat("/pause");
+    worldPaused = paused;
+    return true;
+}
+
+// delta observations: fields of the last response sent with a seq number,
+// later responses are diffed against it while the client acknowledges it
+let deltaState = null;
+let deltaSeq = 0;
+
+function observeCompact(req) {
+    if (!req.body || !req.body.delta) {
+        return { body: bot.observeCompact(), seq: null, base: null };
+    }
+    let base = 0;
+    if (deltaState && req.body.ackSeq === deltaState.seq) {
+        base = deltaState.seq;
+    } else {
+        deltaState = { previous: {}, members: {}, seq: 0 };
+    }
+    const body = bot.observeCompact(deltaState);
+    deltaState.seq = ++deltaSeq;
+    return { body, seq: deltaState.seq, base };
+}
+
+function sendObservation(req, res) {
+    if (req.get("X-Voyager-Wire") === WIRE_FORMAT) {
+        const { body, seq, base } = observeCompact(req);
+        res.set("X-Voyager-Wire", WIRE_FORMAT);
+        if (seq !== null) {
+            res.set("X-Voyager-Seq", String(seq));
+            res.set("X-Voyager-Base", String(base));
+        }
+        res.type("json").send(body);
+    } else {
+        res.json(bot.observe());
+    }
+}
+
 let browser, page, screenshotInterval;
 let episodeDir;
 let viewerServerPort = 3007;  // default; overridden by req.body.viewerPort if provided
@@ -39,11 +95,14 @@ app.use(bodyParser.urlencoded({ limit: "50mb", extended: false }));
 app.post("/start", (req, res) => {
     if (bot) onDisconnect("Restarting bot");
     bot = null;
+    deltaState = null;
+    // the client knows whether it left the world paused
+    worldPaused = req.body.paused === true;
     console.log(req.body);
     bot = mineflayer.createBot({
         host: "localhost", // minecraft server ip
         port: req.body.port, // minecraft server port
-        username: "bot",
+        username: req.body.username || "bot",
         disableChatSigning: true,
         checkTimeoutInterval: 60 * 60 * 1000,
     });
@@ -141,7 +200,7 @@ app.post("/start", (req, res) => {
         }
 
         await bot.waitForTicks(bot.waitTicks * itemTicks);
-        res.json(bot.observe());
+        sendObservation(req, res);
 
         initCounter(bot);
         bot.chat("/gamerule keepInventory true");
@@ -189,18 +248,118 @@ app.post("/start", (req, res) => {
     }
 });
 
+app.post("/programs", (req, res) => {
+    const programs = req.body.programs || {};
+    const compiled = [];
+    for (const hash in programs) {
+        try {
+            compiled.push(compileProgram(hash, programs[hash]));
+        } catch (err) {
+            res.status(400).json({ error: `Program ${hash}: ${err.message}` });
+            return;
+        }
+    }
+    for (const program of compiled) {
+        programStore.set(program.hash, program);
+    }
+    res.json({
+        registered: compiled.length,
+        total: programStore.size,
+    });
+});
+
+// Parse a program once. Running its factory defines the top level functions
+// of the program against the scope of one step (its bot proxy, fail counters
+// and the functions of the other programs) and returns them.
+function compileProgram(hash, source) {
+    const names = [
+        ...source.matchAll(/^(?:async\s+)?function\s*\*?\s*([\w$]+)/gm),
+    ].map((match) => match[1]);
+    const factory = new Function(
+        "scope",
+        "with (scope) {\n" +
+            source +
+            "\nreturn { " +
+            names.join(", ") +
+            " };\n}\n//# sourceURL=program-" +
+            hash +
+            ".js"
+    );
+    return { hash, source, factory };
+}
+
 app.post("/step", async (req, res) => {
+    // resolve registered programs before touching the bot
+    let programs = [];
+    if (req.body.programHashes) {
+        const missing = req.body.programHashes.filter(
+            (hash) => !programStore.has(hash)
+        );
+        if (missing.length > 0) {
+            res.status(409).json({ missing: missing });
+            return;
+        }
+        programs = req.body.programHashes.map((hash) => programStore.get(hash));
+    } else if (req.body.programs) {
+        try {
+            programs = [compileProgram("inline", req.body.programs)];
+        } catch (err) {
+            res.status(400).json({ error: err.message });
+            return;
+        }
+    }
+    // streaming steps write one json line per event and end with the events
+    const stream = req.body.stream === true;
+    const step = { aborted: false, abort: null };
+    const aborted = new Promise((resolve) => {
+        step.abort = (reason = new Error("Program aborted by the client")) => {
+            step.aborted = true;
+            resolve(reason);
+        };
+    });
+    currentStep = step;
+    // once aborted, any bot access of the abandoned program throws
+    const stepBot = new Proxy(bot, {
+        get(target, prop) {
+            if (step.aborted) {
+                throw new Error("Program aborted by the client");
+            }
+            return Reflect.get(target, prop);
+        },
+    });
+    if (stream) {
+        res.set("Content-Type", "application/x-ndjson");
+        res.flushHeaders();
+        bot.onEvent = (eventName, value) => {
+            res.write(
+                JSON.stringify({ event: [eventName, { [eventName]: value }] }) +
+                    "\n"
+            );
+        };
+    }
+
     // import useful package
     let response_sent = false;
+    function respond() {
+        if (response_sent) return;
+        response_sent = true;
+        bot.onEvent = null;
+        if (currentStep === step) currentStep = null;
+        if (!stream) {
+            sendObservation(req, res);
+        } else if (req.get("X-Voyager-Wire") === WIRE_FORMAT) {
+            const { body, seq, base } = observeCompact(req);
+            const delta = seq !== null ? `,"seq":${seq},"base":${base}` : "";
+            res.end('{"events":' + body + delta + "}\n");
+        } else {
+            res.end(JSON.stringify({ events: bot.observeEvents() }) + "\n");
+        }
+    }
     function otherError(err) {
         console.log("Uncaught Error");
-        bot.emit("error", handleError(err));
-        bot.waitForTicks(bot.waitTicks).then(() => {
-            if (!response_sent) {
-                response_sent = true;
-                res.json(bot.observe());
-            }
-        });
+        // end the program now, the step reports the error and returns
+        step.abort(err);
+        stopBot();
     }
 
     process.on("uncaughtException", otherError);
@@ -214,6 +373,7 @@ app.post("/step", async (req, res) => {
     mcData.itemsByName["leather_boots"] = mcData.itemsByName["leather_boots"];
     mcData.itemsByName["lapis_lazuli_ore"] = mcData.itemsByName["lapis_ore"];
     mcData.blocksByName["lapis_lazuli_ore"] = mcData.blocksByName["lapis_ore"];
+    const mineflayerPathfinder = require("mineflayer-pathfinder");
     const {
         Movements,
         goals: {
@@ -240,7 +400,7 @@ app.post("/step", async (req, res) => {
         XYZCoordinates,
         SafeBlock,
         GoalPlaceBlockOptions,
-    } = require("mineflayer-pathfinder");
+    } = mineflayerPathfinder;
     const { Vec3 } = require("vec3");
 
     // Set up pathfinder
@@ -264,19 +424,47 @@ app.post("/step", async (req, res) => {
 
     bot.on("physicTick", onTick);
 
-    // initialize fail count
-    let _craftItemFailCount = 0;
-    let _killMobFailCount = 0;
-    let _mineBlockFailCount = 0;
-    let _placeItemFailCount = 0;
-    let _smeltItemFailCount = 0;
+    // what the programs and the code see besides the globals, including the
+    // fail counts of the control primitives
+    const scope = {
+        ...mineflayerPathfinder,
+        ...mineflayerPathfinder.goals,
+        bot: stepBot,
+        mcData,
+        Vec3,
+    };
+    // primitives tolerate up to 10 misses (e.g. no block nearby) and throw on
+    // the next one, streaming clients hear about it before the code may
+    // catch the error
+    for (const primitive of [
+        "craftItem",
+        "killMob",
+        "mineBlock",
+        "placeItem",
+        "smeltItem",
+    ]) {
+        let failCount = 0;
+        Object.defineProperty(scope, `_${primitive}FailCount`, {
+            get: () => failCount,
+            set: (value) => {
+                failCount = value;
+                if (bot.onEvent && value > 10) {
+                    bot.onEvent("onError", `${primitive} failed ${value} times`);
+                }
+            },
+        });
+    }
+    for (const program of programs) {
+        Object.assign(scope, program.factory(scope));
+    }
 
     // Retrieve array form post bod
     const code = req.body.code;
-    const programs = req.body.programs;
+    // unpausing here shares the tick wait below instead of a /pause request
+    if (req.body.unpause === true) setPaused(false);
     bot.cumulativeObs = [];
     await bot.waitForTicks(bot.waitTicks);
-    const r = await evaluateCode(code, programs);
+    const r = await Promise.race([evaluateCode(code), aborted]);
     process.off("uncaughtException", otherError);
     if (r !== "success") {
         bot.emit("error", handleError(r));
@@ -284,16 +472,16 @@ app.post("/step", async (req, res) => {
     await returnItems();
     // wait for last message
     await bot.waitForTicks(bot.waitTicks);
-    if (!response_sent) {
-        response_sent = true;
-        res.json(bot.observe());
-    }
+    respond();
     bot.removeListener("physicTick", onTick);
+    // the observation is taken, pause while the client thinks
+    if (req.body.pause === true) setPaused(true);
 
-    async function evaluateCode(code, programs) {
+    async function evaluateCode(code) {
+        const bot = stepBot;
         // Echo the code produced for players to see it. Don't echo when the bot code is already producing dialog or it will double echo
         try {
-            await eval("(async () => {" + programs + "\n" + code + "})()");
+            await eval("(async () => { with (scope) {\n" + code + "\n} })()");
             return "success";
         } catch (err) {
             return err;
@@ -310,6 +498,8 @@ app.post("/step", async (req, res) => {
             const posDifference = currentPos.distanceTo(oldestPos);
 
             if (posDifference < posThreshold) {
+                // no progress for 500 ticks, streaming clients may abort
+                if (bot.onEvent) bot.onEvent("onStuck", currentPos);
                 teleportBot(); // execute the function
             }
 
@@ -384,16 +574,13 @@ app.post("/step", async (req, res) => {
         const final_line = stack.split("\n")[1];
         const regex = /<anonymous>:(\d+):\d+\)/;
 
-        const programs_length = programs.split("\n").length;
         let match_line = null;
         for (const line of stack.split("\n")) {
             const match = regex.exec(line);
             if (match) {
-                const line_num = parseInt(match[1]);
-                if (line_num >= programs_length) {
-                    match_line = line_num - programs_length;
-                    break;
-                }
+                // the code starts on the second line of the evaluated source
+                match_line = parseInt(match[1]) - 1;
+                break;
             }
         }
         if (!match_line) {
@@ -418,26 +605,88 @@ app.post("/step", async (req, res) => {
             f_line.groups &&
             f_line.groups.file.includes("<anonymous>")
         ) {
-            const { file, line, pos } = f_line.groups;
-            let source =
+            const source =
                 "Your code" +
                 `:${match_line}\n${code.split("\n")[match_line - 1].trim()}\n `;
-            let code_source = "";
-            if (line < programs_length) {
-                source =
-                    "In your program code: " +
-                    programs.split("\n")[line - 1].trim() +
-                    "\n";
-                code_source = `at line ${match_line}:${code
-                    .split("\n")
-                    [match_line - 1].trim()} in your code`;
-            }
+            return source + err.message + "\n";
+        }
+        const program_file =
+            f_line && f_line.groups
+                ? f_line.groups.file.match(/program-(?<hash>\w+)\.js$/)
+                : null;
+        const program = program_file
+            ? programs.find((p) => p.hash === program_file.groups.hash)
+            : null;
+        if (program) {
+            const line = parseInt(f_line.groups.line) - PROGRAM_LINE_OFFSET;
+            const source =
+                "In your program code: " +
+                program.source.split("\n")[line - 1].trim() +
+                "\n";
+            const code_source = `at line ${match_line}:${code
+                .split("\n")
+                [match_line - 1].trim()} in your code`;
             return source + err.message + "\n" + code_source;
         }
         return err.message;
     }
 });
 
+app.post("/abort", (req, res) => {
+    if (!currentStep) {
+        res.json({ aborted: false });
+        return;
+    }
+    currentStep.abort();
+    stopBot();
+    res.json({ aborted: true });
+});
+
+function stopBot() {
+    bot.pathfinder.stop();
+    bot.pvp.stop();
+    bot.stopDigging();
+    bot.clearControlStates();
+}
+
+// Warm reset: keep the process and the bot connection, only reset the
+// per-episode state. Hard resets still go through /start.
+app.post("/reset", async (req, res) => {
+    if (!bot || !bot.entity) {
+        res.status(400).json({ error: "Bot not spawned" });
+        return;
+    }
+    bot.waitTicks = req.body.waitTicks;
+    if (req.body.unpause === true) setPaused(false);
+    bot.globalTickCounter = 0;
+    bot.stuckTickCounter = 0;
+    bot.stuckPosList = [];
+    bot.cumulativeObs = [];
+    // a new task starts with fresh observers, like a bot created by /start
+    bot.obsList.forEach((observer) => observer.reset());
+    bot.pathfinder.stop();
+    bot.pvp.stop();
+    bot.clearControlStates();
+
+    if (req.body.position) {
+        bot.chat(
+            `/tp @s ${req.body.position.x} ${req.body.position.y} ${req.body.position.z}`
+        );
+    }
+    if (req.body.spread) {
+        bot.chat(`/spreadplayers ~ ~ 0 300 under 80 false @s`);
+        await bot.waitForTicks(bot.waitTicks);
+    }
+    bot.iron_pickaxe = false;
+    if (bot.inventory.items().find((item) => item.name === "iron_pickaxe")) {
+        bot.iron_pickaxe = true;
+    }
+
+    await bot.waitForTicks(bot.waitTicks);
+    sendObservation(req, res);
+    if (req.body.pause === true) setPaused(true);
+});
+
 app.post("/stop", async (req, res) => {
     // final screenshot
     if (page) {
@@ -463,12 +712,22 @@ app.post("/pause", (req, res) => {
         res.status(400).json({ error: "Bot not spawned" });
         return;
     }
-    bot.chat("/pause");
+    // an explicit state is idempotent, an empty body toggles
+    const paused =
+        typeof req.body.paused === "boolean" ? req.body.paused : !worldPaused;
+    if (!setPaused(paused)) {
+        res.json({ message: "Success", paused: worldPaused });
+        return;
+    }
     bot.waitForTicks(bot.waitTicks).then(() => {
-        res.json({ message: "Success" });
+        res.json({ message: "Success", paused: worldPaused });
     });
 });
 
+app.get("/health", (req, res) => {
+    res.json({ status: "ok", bot: bot !== null });
+});
+
 // Server listening to PORT 3000
 
 const DEFAULT_PORT = 3000;
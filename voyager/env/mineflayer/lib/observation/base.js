@@ -17,6 +17,33 @@ class Observation {
     reset() {}
 }
 
+function isPlainObject(value) {
+    return value !== null && typeof value === "object" && !Array.isArray(value);
+}
+
+function serializeMembers(value) {
+    const result = {};
+    for (const member in value) {
+        const serialized = JSON.stringify(value[member]);
+        if (serialized !== undefined) result[member] = serialized;
+    }
+    return result;
+}
+
+function diffMembers(before, after) {
+    const set = [];
+    const del = [];
+    for (const member in after) {
+        if (before[member] !== after[member]) {
+            set.push(JSON.stringify(member) + ":" + after[member]);
+        }
+    }
+    for (const member in before) {
+        if (!(member in after)) del.push(member);
+    }
+    return '{"set":{' + set.join(",") + '},"del":' + JSON.stringify(del) + "}";
+}
+
 function inject(bot, obs_list) {
     bot.obsList = [];
     bot.cumulativeObs = [];
@@ -33,12 +60,66 @@ function inject(bot, obs_list) {
             result[obs.name] = obs.observe();
         });
         bot.cumulativeObs.push([event_name, result]);
+        if (bot.onEvent && event_name !== "observe") {
+            bot.onEvent(event_name, result[event_name]);
+        }
     };
-    bot.observe = function () {
+    bot.observeEvents = function () {
         bot.event("observe");
         const result = bot.cumulativeObs;
         bot.cumulativeObs = [];
-        return JSON.stringify(result);
+        return result;
+    };
+    bot.observe = function () {
+        return JSON.stringify(bot.observeEvents());
+    };
+    // Compact single-encoded form: a field equal to the same field of an
+    // earlier event is not repeated but listed in "$same" instead.
+    // With a delta state the fields of the previous response count as earlier
+    // events too, and a changed object field (inventory, status, chests) is
+    // sent in "$patch" as {set, del} of its members when that is shorter.
+    bot.observeCompact = function (state) {
+        const previous = state ? state.previous : {};
+        const members = state ? state.members : {};
+        const parts = bot.observeEvents().map(([eventName, payload]) => {
+            const fields = [];
+            const same = [];
+            const patches = [];
+            for (const key in payload) {
+                const value = payload[key];
+                const serialized = JSON.stringify(value);
+                if (serialized === undefined) continue;
+                if (previous[key] === serialized) {
+                    same.push(key);
+                    continue;
+                }
+                let patch = null;
+                if (state && isPlainObject(value)) {
+                    const current = serializeMembers(value);
+                    if (members[key]) {
+                        patch = diffMembers(members[key], current);
+                        if (patch.length >= serialized.length) patch = null;
+                    }
+                    members[key] = current;
+                } else if (state) {
+                    delete members[key];
+                }
+                if (patch !== null) {
+                    patches.push(JSON.stringify(key) + ":" + patch);
+                } else {
+                    fields.push(JSON.stringify(key) + ":" + serialized);
+                }
+                previous[key] = serialized;
+            }
+            if (same.length > 0) {
+                fields.push('"$same":' + JSON.stringify(same));
+            }
+            if (patches.length > 0) {
+                fields.push('"$patch":{' + patches.join(",") + "}");
+            }
+            return "[" + JSON.stringify(eventName) + ",{" + fields.join(",") + "}]";
+        });
+        return "[" + parts.join(",") + "]";
     };
 }
 
@@ -36,6 +36,7 @@ class BlockRecords extends Observation {
 
     reset() {
         this.records = new Set();
+        this.tick = 0;
     }
 }
 
@@ -0,0 +1,59 @@
+import os.path
+import sys
+
+import voyager.utils as U
+
+from .bridge import VoyagerEnv
+from .process_monitor import SubprocessMonitor
+
+
+class MockVoyagerEnv(VoyagerEnv):
+    """
+    VoyagerEnv backed by mock_server.py instead of mineflayer and Minecraft,
+    for benchmarking and profiling the orchestrator without a game.
+    """
+
+    def __init__(self, mc_port=25565, seed=0, step_delay=0.0, **kwargs):
+        self.seed = seed
+        self.step_delay = step_delay
+        super().__init__(mc_port=mc_port, **kwargs)
+
+    def server_arguments(self):
+        return ["--seed", str(self.seed), "--step-delay", str(self.step_delay)]
+
+    def get_mineflayer_process(self, server_port):
+        name = self.mineflayer_name(server_port)
+        U.f_mkdir(self.log_path, name)
+        file_path = os.path.abspath(os.path.dirname(__file__))
+        return SubprocessMonitor(
+            commands=[
+                sys.executable,
+                U.f_join(file_path, "mock_server.py"),
+                str(server_port),
+                *self.server_arguments(),
+            ],
+            name=name,
+            ready_match=r"Server started on port (\d+)",
+            log_path=U.f_join(self.log_path, name),
+        )
+
+
+class ReplayVoyagerEnv(MockVoyagerEnv):
+    """
+    VoyagerEnv served by the replay mode of mock_server.py: either a traffic
+    log recorded with VoyagerEnv(record_path=...) or the events directory of an
+    EventRecorder checkpoint.
+    """
+
+    def __init__(self, replay_path=None, replay_ckpt_dir=None, **kwargs):
+        assert bool(replay_path) != bool(
+            replay_ckpt_dir
+        ), "Exactly one of replay_path or replay_ckpt_dir must be given"
+        self.replay_path = replay_path
+        self.replay_ckpt_dir = replay_ckpt_dir
+        super().__init__(**kwargs)
+
+    def server_arguments(self):
+        if self.replay_path:
+            return ["--replay", os.path.abspath(self.replay_path)]
+        return ["--replay-events", os.path.abspath(self.replay_ckpt_dir)]
@@ -0,0 +1,859 @@
+"""
+Deterministic stand-in for the mineflayer server.
+
+It speaks the same HTTP protocol as mineflayer/index.js (/start, /step,
+/pause, /stop, /reset, /programs, /abort, /health) and answers with
+synthetic but schema-correct observations produced by a small scripted
+world model, so the Python orchestrator can be load-tested and profiled
+without Minecraft or Node.
+
+It can also replay a recorded run (see TrafficRecorder in voyager/env/transport.py) or the
+event files EventRecorder wrote to a checkpoint directory.
+
+Run it like the real server, it only depends on the standard library and
+the wire format constants of observation.py next to it:
+
+    python voyager/env/mock_server.py 3000 --seed 0
+    python voyager/env/mock_server.py 3000 --replay logs/traffic.jsonl.gz
+    python voyager/env/mock_server.py 3000 --replay-events ckpt
+"""
+import argparse
+import collections
+import gzip
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    from .observation import (
+        BASE_HEADER,
+        PATCH_FIELD,
+        SAME_FIELD,
+        SEQ_HEADER,
+        WIRE_FORMAT,
+        WIRE_HEADER,
+    )
+except ImportError:
+    # run as a script, import the module next to it without the voyager
+    # package and its dependencies
+    from observation import (
+        BASE_HEADER,
+        PATCH_FIELD,
+        SAME_FIELD,
+        SEQ_HEADER,
+        WIRE_FORMAT,
+        WIRE_HEADER,
+    )
+
+RECIPES = {
+    "oak_planks": ({"oak_log": 1}, 4),
+    "birch_planks": ({"birch_log": 1}, 4),
+    "spruce_planks": ({"spruce_log": 1}, 4),
+    "stick": ({"oak_planks": 2}, 4),
+    "crafting_table": ({"oak_planks": 4}, 1),
+    "chest": ({"oak_planks": 8}, 1),
+    "wooden_pickaxe": ({"oak_planks": 3, "stick": 2}, 1),
+    "wooden_sword": ({"oak_planks": 2, "stick": 1}, 1),
+    "wooden_axe": ({"oak_planks": 3, "stick": 2}, 1),
+    "stone_pickaxe": ({"cobblestone": 3, "stick": 2}, 1),
+    "stone_sword": ({"cobblestone": 2, "stick": 1}, 1),
+    "stone_axe": ({"cobblestone": 3, "stick": 2}, 1),
+    "furnace": ({"cobblestone": 8}, 1),
+    "torch": ({"coal": 1, "stick": 1}, 4),
+    "iron_pickaxe": ({"iron_ingot": 3, "stick": 2}, 1),
+    "iron_sword": ({"iron_ingot": 2, "stick": 1}, 1),
+    "bucket": ({"iron_ingot": 3}, 1),
+    "shield": ({"oak_planks": 6, "iron_ingot": 1}, 1),
+    "diamond_pickaxe": ({"diamond": 3, "stick": 2}, 1),
+}
+# recipes that need a crafting table nearby
+TABLE_RECIPES = {
+    name
+    for name in RECIPES
+    if name not in ("oak_planks", "birch_planks", "spruce_planks", "stick", "crafting_table")
+}
+DROPS = {
+    "oak_log": "oak_log",
+    "birch_log": "birch_log",
+    "spruce_log": "spruce_log",
+    "dirt": "dirt",
+    "grass_block": "dirt",
+    "sand": "sand",
+    "stone": "cobblestone",
+    "cobblestone": "cobblestone",
+    "coal_ore": "coal",
+    "iron_ore": "raw_iron",
+    "copper_ore": "raw_copper",
+    "gold_ore": "raw_gold",
+    "diamond_ore": "diamond",
+}
+PICKAXES = ["wooden_pickaxe", "stone_pickaxe", "iron_pickaxe", "diamond_pickaxe"]
+REQUIRED_PICKAXE = {
+    "stone": 0,
+    "cobblestone": 0,
+    "coal_ore": 0,
+    "iron_ore": 1,
+    "copper_ore": 1,
+    "gold_ore": 2,
+    "diamond_ore": 2,
+}
+SMELTING = {
+    "raw_iron": "iron_ingot",
+    "raw_copper": "copper_ingot",
+    "raw_gold": "gold_ingot",
+    "sand": "glass",
+    "porkchop": "cooked_porkchop",
+    "beef": "cooked_beef",
+    "mutton": "cooked_mutton",
+    "chicken": "cooked_chicken",
+}
+FUELS = {"coal", "oak_planks", "oak_log", "stick"}
+MOB_DROPS = {
+    "pig": "porkchop",
+    "cow": "beef",
+    "sheep": "mutton",
+    "chicken": "chicken",
+    "zombie": "rotten_flesh",
+    "skeleton": "bone",
+    "spider": "string",
+    "creeper": "gunpowder",
+}
+BIOME_BLOCKS = {
+    "plains": ["grass_block", "dirt", "oak_log", "stone", "coal_ore"],
+    "forest": ["grass_block", "dirt", "oak_log", "birch_log", "stone"],
+    "taiga": ["grass_block", "dirt", "spruce_log", "stone", "iron_ore"],
+    "desert": ["sand", "sandstone", "stone", "copper_ore"],
+}
+UNDERGROUND_BLOCKS = ["stone", "coal_ore", "iron_ore", "copper_ore", "gold_ore", "diamond_ore"]
+TIMES = ["sunrise", "day", "noon", "sunset", "night", "midnight"]
+
+CALL_PATTERN = re.compile(r"(bot\.chat|\b[A-Za-z_]\w*)\s*\(")
+FUNCTION_PATTERN = re.compile(r"(?:async\s+)?function\s+(\w+)\s*\(([^)]*)\)\s*\{")
+JS_KEYWORDS = {"if", "for", "while", "switch", "catch", "function", "return", "await"}
+
+
+class MockError(Exception):
+    pass
+
+
+class MockWorld:
+    """Scripted world model: inventory, crafting, smelting, mining and mobs."""
+
+    def __init__(self, seed=0):
+        self.seed = seed
+        self.reset(hard=True)
+
+    def reset(self, hard=True, inventory=None, equipment=None, position=None):
+        self.rng = random.Random(self.seed)
+        if hard:
+            self.inventory = dict(inventory or {})
+            self.equipment = list(equipment or [None] * 6)
+        self.position = dict(position or {"x": 0.5, "y": 64.0, "z": 0.5})
+        self.health = 20.0
+        self.food = 20.0
+        self.biome = "plains"
+        self.time_index = 1
+        self.underground = False
+        self.block_records = set()
+        self.chests = {}
+        self.ticks = 0
+
+    @property
+    def voxels(self):
+        blocks = UNDERGROUND_BLOCKS if self.underground else BIOME_BLOCKS[self.biome]
+        return blocks[: 3 + self.rng.randint(0, len(blocks) - 3)]
+
+    def entities(self):
+        mobs = sorted(MOB_DROPS)
+        return {
+            mob: round(4 + 28 * self.rng.random(), 2)
+            for mob in self.rng.sample(mobs, 3)
+        }
+
+    def status(self):
+        return {
+            "health": self.health,
+            "food": self.food,
+            "saturation": 5,
+            "oxygen": 20,
+            "position": dict(self.position),
+            "velocity": {"x": 0, "y": -0.0784, "z": 0},
+            "yaw": 0,
+            "pitch": 0,
+            "onGround": True,
+            "equipment": list(self.equipment),
+            "name": "bot",
+            "timeSinceOnGround": 0,
+            "isInWater": False,
+            "isInLava": False,
+            "isInWeb": False,
+            "isCollidedHorizontally": False,
+            "isCollidedVertically": True,
+            "biome": self.biome,
+            "entities": self.entities(),
+            "timeOfDay": TIMES[self.time_index % len(TIMES)],
+            "inventoryUsed": len(self.inventory),
+            "elapsedTime": self.ticks,
+        }
+
+    def observation(self, event_type, value=None):
+        payload = {}
+        if event_type != "observe":
+            payload[event_type] = value
+        voxels = self.voxels
+        self.block_records.update(voxels)
+        payload["voxels"] = voxels
+        payload["status"] = self.status()
+        payload["inventory"] = dict(self.inventory)
+        payload["nearbyChests"] = dict(self.chests)
+        payload["blockRecords"] = sorted(self.block_records)
+        return payload
+
+    def give(self, item, count):
+        self.inventory[item] = self.inventory.get(item, 0) + count
+
+    def take(self, item, count):
+        self.inventory[item] -= count
+        if self.inventory[item] <= 0:
+            del self.inventory[item]
+
+    def tick(self, ticks=20):
+        self.ticks += ticks
+        self.position["x"] += self.rng.uniform(-4, 4)
+        self.position["z"] += self.rng.uniform(-4, 4)
+
+    # ---------------- control primitives -----------------
+    def mine_block(self, emit, name=None, count=1):
+        if name not in DROPS:
+            raise MockError(f"No block named {name}")
+        best = max(
+            [PICKAXES.index(item) for item in self.inventory if item in PICKAXES],
+            default=-1,
+        )
+        required = REQUIRED_PICKAXE.get(name, -1)
+        if best < required:
+            emit("onChat", f"I need at least a {PICKAXES[required]} to mine {name}!")
+            return
+        self.tick(40 * count)
+        self.block_records.add(name)
+        self.give(DROPS[name], count)
+        if name in UNDERGROUND_BLOCKS and name != "stone":
+            self.underground = True
+        emit("onSave", f"{name}_mined")
+
+    def craft_item(self, emit, name=None, count=1):
+        if name not in RECIPES:
+            raise MockError(f"No item named {name}")
+        ingredients, produced = RECIPES[name]
+        if name in TABLE_RECIPES and "crafting_table" not in self.block_records:
+            emit("onChat", f"I cannot make {name} because there is no crafting table nearby")
+            return
+        missing = [
+            f"{need * count - self.inventory.get(item, 0)} more {item}"
+            for item, need in ingredients.items()
+            if self.inventory.get(item, 0) < need * count
+        ]
+        if missing:
+            emit("onChat", f"I cannot make {name} because I need: {', '.join(missing)}")
+            return
+        for item, need in ingredients.items():
+            self.take(item, need * count)
+        self.give(name, produced * count)
+        self.tick(10)
+        emit("onChat", f"I did the recipe for {name} {count} times")
+
+    def smelt_item(self, emit, name=None, fuel="coal", count=1):
+        if name not in SMELTING:
+            raise MockError(f"{name} is not a valid input")
+        if "furnace" not in self.block_records:
+            raise MockError("No furnace nearby")
+        if fuel not in FUELS:
+            raise MockError(f"{fuel} is not a valid fuel")
+        if self.inventory.get(name, 0) < count:
+            emit("onChat", f"No {name} to smelt in inventory")
+            return
+        if self.inventory.get(fuel, 0) < 1:
+            emit("onChat", f"No {fuel} as fuel in inventory")
+            return
+        self.take(name, count)
+        self.take(fuel, 1)
+        self.give(SMELTING[name], count)
+        self.tick(200 * count)
+        emit("onChat", f"Smelted {count} {name}.")
+
+    def kill_mob(self, emit, name=None, timeout=300):
+        if name not in MOB_DROPS:
+            emit("onChat", f"No {name} nearby, please explore first")
+            return
+        self.tick(60)
+        self.health = max(self.health - self.rng.randint(0, 4), 1.0)
+        self.give(MOB_DROPS[name], 1 + self.rng.randint(0, 2))
+        emit("onSave", f"{name}_killed")
+
+    def place_item(self, emit, name=None, position=None):
+        if self.inventory.get(name, 0) < 1:
+            emit("onChat", f"No {name} in inventory")
+            return
+        self.take(name, 1)
+        self.block_records.add(name)
+        if name == "chest":
+            key = f"({self.position['x']:.0f}, {self.position['y']:.0f}, {self.position['z']:.0f})"
+            self.chests[key] = {}
+        self.tick(5)
+        emit("onChat", f"Placed {name}")
+        emit("onSave", f"{name}_placed")
+
+    def explore_until(self, emit, direction=None, max_time=60, callback=None):
+        self.tick(200)
+        self.time_index += 1
+        self.biome = sorted(BIOME_BLOCKS)[self.rng.randint(0, len(BIOME_BLOCKS) - 1)]
+        self.underground = False
+        emit("onChat", "Explore success.")
+
+    def chat(self, emit, message):
+        if not message.startswith("/"):
+            emit("onChat", message)
+
+
+PRIMITIVES = {
+    "mineBlock": MockWorld.mine_block,
+    "craftItem": MockWorld.craft_item,
+    "smeltItem": MockWorld.smelt_item,
+    "killMob": MockWorld.kill_mob,
+    "placeItem": MockWorld.place_item,
+    "exploreUntil": MockWorld.explore_until,
+}
+PRIMITIVE_PARAMS = {
+    "mineBlock": ("name", "count"),
+    "craftItem": ("name", "count"),
+    "smeltItem": ("name", "fuel", "count"),
+    "killMob": ("name", "timeout"),
+    "placeItem": ("name", "position"),
+    "exploreUntil": ("direction", "max_time", "callback"),
+}
+
+
+def _matching(text, start, open_char, close_char):
+    """Index of the bracket closing the one at start, skipping string literals."""
+    depth = 0
+    quote = None
+    i = start
+    while i < len(text):
+        char = text[i]
+        if quote:
+            if char == "\\":
+                i += 1
+            elif char == quote:
+                quote = None
+        elif char in "\"'`":
+            quote = char
+        elif char == open_char:
+            depth += 1
+        elif char == close_char:
+            depth -= 1
+            if depth == 0:
+                return i
+        i += 1
+    return len(text)
+
+
+def _split_args(text):
+    args, depth, quote, current = [], 0, None, ""
+    for char in text:
+        if quote:
+            quote = None if char == quote else quote
+        elif char in "\"'`":
+            quote = char
+        elif char in "([{":
+            depth += 1
+        elif char in ")]}":
+            depth -= 1
+        elif char == "," and depth == 0:
+            args.append(current.strip())
+            current = ""
+            continue
+        current += char
+    if current.strip():
+        args.append(current.strip())
+    return args
+
+
+def _literal(arg):
+    if len(arg) >= 2 and arg[0] == arg[-1] and arg[0] in "\"'`":
+        return arg[1:-1]
+    try:
+        return int(arg)
+    except ValueError:
+        try:
+            return float(arg)
+        except ValueError:
+            return None
+
+
+class MockProgram:
+    """
+    Interprets the generated JavaScript just enough to drive the world: calls
+    to control primitives and bot.chat are executed in source order and
+    functions defined in the programs or the code are expanded in place.
+    """
+
+    def __init__(self, programs, code):
+        self.functions = {}
+        for source in (programs, code):
+            for match in FUNCTION_PATTERN.finditer(source):
+                end = _matching(source, match.end() - 1, "{", "}")
+                self.functions[match.group(1)] = source[match.end() : end]
+        self.code = code
+
+    def run(self, world, emit):
+        self._run(self._top_level(self.code), world, emit, [])
+
+    def _top_level(self, code):
+        # drop function bodies, they only run when called
+        result, i = "", 0
+        for match in FUNCTION_PATTERN.finditer(code):
+            if match.start() < i:
+                continue
+            result += code[i : match.start()]
+            i = _matching(code, match.end() - 1, "{", "}") + 1
+        return result + code[i:]
+
+    def _run(self, source, world, emit, stack):
+        for match in CALL_PATTERN.finditer(source):
+            name = match.group(1)
+            end = _matching(source, match.end() - 1, "(", ")")
+            args = _split_args(source[match.end() : end])
+            if name == "bot.chat":
+                message = _literal(args[0]) if args else None
+                if isinstance(message, str):
+                    world.chat(emit, message)
+                continue
+            if not args or args[0] != "bot" or name in JS_KEYWORDS:
+                continue
+            if name in PRIMITIVES:
+                # arguments that are not literals fall back to their defaults
+                values = [_literal(arg) for arg in args[1:]]
+                kwargs = {
+                    param: value
+                    for param, value in zip(PRIMITIVE_PARAMS[name], values)
+                    if value is not None
+                }
+                PRIMITIVES[name](world, emit, **kwargs)
+            elif name in self.functions:
+                if name in stack or len(stack) > 16:
+                    continue
+                self._run(self.functions[name], world, emit, stack + [name])
+            else:
+                raise MockError(f"{name} is not defined")
+
+
+class MockServer:
+    def __init__(self, seed=0, step_delay=0.0):
+        self.world = MockWorld(seed=seed)
+        self.step_delay = step_delay
+        self.programs = {}
+        self.cumulative = []
+        self.started = False
+        self.paused = False
+        self.delta = DeltaEncoder()
+        self.lock = threading.Lock()
+
+    def emit(self, event_type, value):
+        self.cumulative.append([event_type, self.world.observation(event_type, value)])
+
+    def observe(self):
+        self.emit("observe", None)
+        events, self.cumulative = self.cumulative, []
+        return events
+
+    def handle(self, path, body, negotiated):
+        if path == "/health":
+            return json_response({"status": "ok", "bot": self.started})
+        if path == "/start":
+            self.delta.reset()
+            return events_response(self.start(body), negotiated, body, self.delta)
+        if path == "/programs":
+            self.programs.update(body.get("programs", {}))
+            return json_response(
+                {"registered": len(body.get("programs", {})), "total": len(self.programs)}
+            )
+        if path == "/stop":
+            self.started = False
+            return json_response({"message": "Bot stopped"})
+        if not self.started:
+            return json_response({"error": "Bot not spawned"}, status=400)
+        if path == "/reset":
+            if body.get("unpause") is True:
+                self.paused = False
+            self.world.reset(hard=False, position=body.get("position"))
+            self.cumulative = []
+            response = events_response(self.observe(), negotiated, body, self.delta)
+            if body.get("pause") is True:
+                self.paused = True
+            return response
+        if path == "/step":
+            return self.step(body, negotiated)
+        if path == "/pause":
+            # an explicit state is idempotent, an empty body toggles
+            paused = body.get("paused")
+            self.paused = paused if isinstance(paused, bool) else not self.paused
+            return json_response({"message": "Success", "paused": self.paused})
+        if path == "/abort":
+            # programs run instantly, there is never anything to abort
+            return json_response({"aborted": False})
+        return json_response({"error": "Not found"}, status=404)
+
+    def start(self, body):
+        hard = body.get("reset", "hard") == "hard"
+        equipment = body.get("equipment") or None
+        self.world.reset(
+            hard=hard,
+            inventory=body.get("inventory") if hard else None,
+            equipment=equipment if hard else None,
+            position=body.get("position"),
+        )
+        self.cumulative = []
+        self.started = True
+        self.paused = body.get("paused") is True
+        return self.observe()
+
+    def step(self, body, negotiated):
+        programs = body.get("programs", "")
+        if "programHashes" in body:
+            missing = [h for h in body["programHashes"] if h not in self.programs]
+            if missing:
+                return json_response({"missing": missing}, status=409)
+            programs = "".join(f"{self.programs[h]}\n\n" for h in body["programHashes"])
+        if body.get("unpause") is True:
+            self.paused = False
+        self.world.ticks = 0
+        try:
+            if self.paused:
+                # the bot of the real server would hang until the timeout
+                raise MockError("World is paused, the program cannot make progress")
+            MockProgram(programs, body.get("code", "")).run(self.world, self.emit)
+        except MockError as e:
+            self.emit("onError", str(e))
+        if self.step_delay:
+            time.sleep(self.step_delay)
+        events = self.observe()
+        if body.get("pause") is True:
+            self.paused = True
+        if body.get("stream") is True:
+            return stream_response(events, negotiated, body, self.delta)
+        return events_response(events, negotiated, body, self.delta)
+
+
+class ReplayServer:
+    """
+    Serves the responses of a recorded run back in order, one queue per
+    endpoint, so agents and parsing can be benchmarked against identical env
+    behavior. Steps whose code differs from the recording are still answered
+    but counted as divergences.
+    """
+
+    def __init__(self, records):
+        self.responses = collections.defaultdict(collections.deque)
+        self.programs = {}
+        records = expand_delta_records(records)
+        for record in records:
+            if "endpoint" in record:
+                self.responses[record["endpoint"]].append(record)
+        self.divergences = 0
+        self.last_observation = None
+        self.delta = DeltaEncoder()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_log(cls, path):
+        """Load a log written by voyager.env.transport.TrafficRecorder."""
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            return cls([json.loads(line) for line in f if line.strip()])
+
+    @classmethod
+    def from_event_recorder(cls, ckpt_dir):
+        """
+        Build a replay from the event files EventRecorder writes to
+        ckpt_dir/events: the first observation answers /start and every file
+        answers one /step, in recording order.
+        """
+        events_dir = os.path.join(ckpt_dir, "events")
+
+        def get_timestamp(string):
+            timestamp = "_".join(string.split("_")[-2:])
+            return time.mktime(time.strptime(timestamp, "%Y%m%d_%H%M%S"))
+
+        records = []
+        for name in sorted(os.listdir(events_dir), key=get_timestamp):
+            with open(os.path.join(events_dir, name)) as f:
+                events = json.load(f)
+            if not events:
+                continue
+            if not records:
+                records.append({"endpoint": "/start", "status": 200, "events": [events[-1]]})
+            records.append({"endpoint": "/step", "status": 200, "events": events})
+        return cls(records)
+
+    def handle(self, path, body, negotiated):
+        if path == "/health":
+            return json_response({"status": "ok", "bot": True})
+        if path == "/programs":
+            self.programs.update(body.get("programs", {}))
+            return json_response(
+                {"registered": len(body.get("programs", {})), "total": len(self.programs)}
+            )
+        if path == "/pause":
+            return json_response({"message": "Success"})
+        if path == "/abort":
+            return json_response({"aborted": False})
+        if path == "/stop":
+            return json_response({"message": "Bot stopped"})
+        if path == "/reset" and not self.responses[path]:
+            # recorded with cold resets only
+            path = "/start"
+        if path not in ("/start", "/reset", "/step"):
+            return json_response({"error": "Not found"}, status=404)
+        if path == "/start" and not self.responses[path] and self.last_observation:
+            # event files hold no resets, the bot stays where it was
+            return events_response([self.last_observation], negotiated, body, self.delta)
+        if not self.responses[path]:
+            return json_response({"error": f"Replay log exhausted for {path}"}, status=410)
+        record = self.responses[path].popleft()
+        recorded_code = record.get("request", {}).get("code")
+        if recorded_code is not None and recorded_code != body.get("code"):
+            self.divergences += 1
+            print(f"Replay diverged from the recording at {path} ({self.divergences} so far)")
+        if record.get("status", 200) != 200:
+            return json_response(json.loads(record["body"]), status=record["status"])
+        events = recorded_events(record)
+        self.last_observation = events[-1]
+        if body.get("stream") is True:
+            return stream_response(events, negotiated, body, self.delta)
+        return events_response(events, negotiated, body, self.delta)
+
+
+class DeltaEncoder:
+    """Server side of delta observations, same as observeCompact in index.js."""
+
+    def __init__(self):
+        self.seq = 0
+        self.state = None
+
+    def reset(self):
+        self.state = None
+
+    def encode(self, events, body):
+        """Return the compact events with the seq and base of the response."""
+        if not body.get("delta"):
+            return compact_events(events), None, None
+        base = 0
+        if self.state is not None and body.get("ackSeq") == self.state["seq"]:
+            base = self.state["seq"]
+        else:
+            self.state = {"previous": {}, "members": {}, "seq": 0}
+        compact = compact_events(events, self.state)
+        self.seq += 1
+        self.state["seq"] = self.seq
+        return compact, self.seq, base
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(",", ":"))
+
+
+def compact_events(events, state=None):
+    """Same encoding as bot.observeCompact in mineflayer/lib/observation/base.js."""
+    previous = state["previous"] if state else {}
+    members = state["members"] if state else {}
+    compact = []
+    for event_type, payload in events:
+        fields = {}
+        same = []
+        patches = {}
+        for key, value in payload.items():
+            serialized = _dumps(value)
+            if previous.get(key) == serialized:
+                same.append(key)
+                continue
+            patch = None
+            if state is not None and isinstance(value, dict):
+                current = {member: _dumps(v) for member, v in value.items()}
+                if key in members:
+                    before = members[key]
+                    patch = {
+                        "set": {
+                            member: value[member]
+                            for member in current
+                            if before.get(member) != current[member]
+                        },
+                        "del": [member for member in before if member not in current],
+                    }
+                    if len(_dumps(patch)) >= len(serialized):
+                        patch = None
+                members[key] = current
+            elif state is not None:
+                members.pop(key, None)
+            if patch is not None:
+                patches[key] = patch
+            else:
+                fields[key] = value
+            previous[key] = serialized
+        if same:
+            fields[SAME_FIELD] = same
+        if patches:
+            fields[PATCH_FIELD] = patches
+        compact.append([event_type, fields])
+    return compact
+
+
+def expand_events(compact, latest=None):
+    if latest is None:
+        latest = {}
+    events = []
+    for event_type, payload in compact:
+        for key in payload.pop(SAME_FIELD, ()):
+            payload[key] = latest[key]
+        for key, changes in payload.pop(PATCH_FIELD, {}).items():
+            value = dict(latest[key])
+            value.update(changes["set"])
+            for member in changes["del"]:
+                value.pop(member, None)
+            payload[key] = value
+        latest.update(payload)
+        events.append([event_type, payload])
+    return events
+
+
+def expand_delta_records(records):
+    """Rebuild delta-encoded responses into full events, in recording order."""
+    latest = {}
+    for record in records:
+        if "endpoint" not in record or record.get("status", 200) != 200:
+            continue
+        if record.get("stream"):
+            lines = record["body"].strip().splitlines()
+            final = json.loads(lines[-1]) if lines else {}
+            if "seq" not in final:
+                continue
+            compact, base = final["events"], final["base"]
+        elif "seq" in record:
+            compact, base = json.loads(record["body"]), record["base"]
+        else:
+            continue
+        if not base:
+            latest = {}
+        record["events"] = expand_events(compact, latest)
+    return records
+
+
+def recorded_events(record):
+    if "events" in record:
+        return record["events"]
+    if record.get("stream"):
+        final = json.loads(record["body"].strip().splitlines()[-1])
+        return expand_events(final["events"])
+    if record.get("wire") == WIRE_FORMAT:
+        return expand_events(json.loads(record["body"]))
+    return json.loads(json.loads(record["body"]))
+
+
+def json_response(data, status=200, headers=None):
+    return status, "application/json", json.dumps(data).encode("utf-8"), headers or {}
+
+
+def events_response(events, negotiated, body=None, delta=None):
+    if not negotiated:
+        # legacy servers double-encode the events
+        return json_response(json.dumps(events))
+    if delta is None:
+        return json_response(compact_events(events))
+    compact, seq, base = delta.encode(events, body or {})
+    headers = {} if seq is None else {SEQ_HEADER: str(seq), BASE_HEADER: str(base)}
+    return json_response(compact, headers=headers)
+
+
+def stream_response(events, negotiated, body=None, delta=None):
+    lines = [
+        json.dumps({"event": [event_type, {event_type: payload[event_type]}]})
+        for event_type, payload in events
+        if event_type != "observe"
+    ]
+    if not negotiated:
+        final = {"events": events}
+    elif delta is None:
+        final = {"events": compact_events(events)}
+    else:
+        compact, seq, base = delta.encode(events, body or {})
+        final = {"events": compact}
+        if seq is not None:
+            final.update(seq=seq, base=base)
+    lines.append(json.dumps(final))
+    data = ("\n".join(lines) + "\n").encode("utf-8")
+    return 200, "application/x-ndjson", data, {}
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "VoyagerMock/1.0"
+    # headers and body are written separately, avoid the delayed-ack stall
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle({})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self._handle(json.loads(self.rfile.read(length) or b"{}"))
+
+    def _handle(self, body):
+        negotiated = self.headers.get(WIRE_HEADER) == WIRE_FORMAT
+        backend = self.server.backend
+        with backend.lock:
+            status, content_type, data, headers = backend.handle(
+                self.path, body, negotiated
+            )
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if negotiated:
+            self.send_header(WIRE_HEADER, WIRE_FORMAT)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve(backend, port=3000):
+    httpd = ThreadingHTTPServer(("127.0.0.1", port), MockRequestHandler)
+    httpd.backend = backend
+    print(f"Server started on port {port}", flush=True)
+    httpd.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("port", type=int, nargs="?", default=3000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--step-delay", type=float, default=0.0)
+    parser.add_argument("--replay", help="traffic log recorded by VoyagerEnv")
+    parser.add_argument("--replay-events", help="ckpt dir with EventRecorder events")
+    args = parser.parse_args()
+    if args.replay:
+        backend = ReplayServer.from_log(args.replay)
+    elif args.replay_events:
+        backend = ReplayServer.from_event_recorder(args.replay_events)
+    else:
+        backend = MockServer(seed=args.seed, step_delay=args.step_delay)
+    try:
+        serve(backend, port=args.port)
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -0,0 +1,156 @@
+import json
+from typing import Any, Dict, List, NamedTuple
+
+WIRE_FORMAT = "events/1"
+WIRE_HEADER = "X-Voyager-Wire"
+# delta observations: seq of this response and of the response it is diffed
+# against, 0 when it is complete
+SEQ_HEADER = "X-Voyager-Seq"
+BASE_HEADER = "X-Voyager-Base"
+# compact payload fields: fields repeated from the last event carrying them
+# and {set, del} member changes of such fields
+SAME_FIELD = "$same"
+PATCH_FIELD = "$patch"
+
+
+class Observation(dict):
+    """
+    Payload of one event. It stays a plain dict for the agents, the recorder
+    and json dumps, with typed accessors for the common fields.
+    """
+
+    __slots__ = ()
+
+    @property
+    def status(self) -> Dict[str, Any]:
+        return self["status"]
+
+    @property
+    def inventory(self) -> Dict[str, int]:
+        return self["inventory"]
+
+    @property
+    def voxels(self):
+        return self["voxels"]
+
+    @property
+    def block_records(self):
+        return self["blockRecords"]
+
+    @property
+    def nearby_chests(self) -> Dict[str, Any]:
+        return self["nearbyChests"]
+
+    @property
+    def equipment(self):
+        return self["status"]["equipment"]
+
+    @property
+    def position(self) -> Dict[str, float]:
+        return self["status"]["position"]
+
+
+class Event(NamedTuple):
+    type: str
+    data: Observation
+
+
+class ObservationDelta(NamedTuple):
+    """Changes between two observations, e.g. before and after a step."""
+
+    gained: Dict[str, int]
+    lost: Dict[str, int]
+    changed: List[str]
+
+    @classmethod
+    def between(cls, before, after):
+        before_inventory = before.get("inventory", {})
+        after_inventory = after.get("inventory", {})
+        gained = {}
+        lost = {}
+        for item in before_inventory.keys() | after_inventory.keys():
+            diff = after_inventory.get(item, 0) - before_inventory.get(item, 0)
+            if diff > 0:
+                gained[item] = diff
+            elif diff < 0:
+                lost[item] = -diff
+        # shared objects come from "$same" and are unchanged by construction
+        changed = [
+            key
+            for key, value in after.items()
+            if before.get(key) is not value and before.get(key) != value
+        ]
+        return cls(gained, lost, changed)
+
+
+def build_events(raw_events, latest=None):
+    """
+    Turn decoded [event_type, payload] pairs into Events in one pass.
+    Fields listed in "$same" were not repeated by the server and point to the
+    object of the last event that carried them, so unchanged voxels,
+    blockRecords or inventory are shared instead of copied. Fields in
+    "$patch" are {set, del} changes of the members of that last object.
+    latest carries these objects over from a previous response.
+    """
+    if latest is None:
+        latest = {}
+    events = []
+    for event_type, payload in raw_events:
+        same = payload.pop(SAME_FIELD, None)
+        if same:
+            for key in same:
+                payload[key] = latest[key]
+        patch = payload.pop(PATCH_FIELD, None)
+        if patch:
+            for key, changes in patch.items():
+                value = dict(latest[key])
+                value.update(changes["set"])
+                for member in changes["del"]:
+                    value.pop(member, None)
+                payload[key] = value
+        latest.update(payload)
+        events.append(Event(event_type, Observation(payload)))
+    return events
+
+
+class DeltaState:
+    """
+    Client side of delta observations. It acknowledges the last response it
+    rebuilt, the server diffs the next one against it, and restarts from a
+    complete response whenever the two lose track of each other.
+    """
+
+    def __init__(self):
+        self.seq = None
+        self.latest = {}
+
+    def request_fields(self):
+        return {"delta": True, "ackSeq": self.seq}
+
+    def build(self, raw_events, seq, base):
+        if base:
+            if base != self.seq:
+                raise RuntimeError(
+                    f"Observation delta against {base}, last received {self.seq}"
+                )
+            latest = self.latest
+        else:
+            latest = {}
+        events = build_events(raw_events, latest)
+        self.seq = seq
+        self.latest = latest
+        return events
+
+
+def decode_events(res, delta=None):
+    if res.headers.get(WIRE_HEADER) == WIRE_FORMAT:
+        raw_events = json.loads(res.content)
+        if delta is not None and SEQ_HEADER in res.headers:
+            return delta.build(
+                raw_events,
+                int(res.headers[SEQ_HEADER]),
+                int(res.headers[BASE_HEADER]),
+            )
+        return build_events(raw_events)
+    # legacy servers double-encode the events
+    return build_events(json.loads(res.json()))
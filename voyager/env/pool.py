@@ -0,0 +1,186 @@
+import collections
+import contextlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import voyager.utils as U
+
+from .bridge import VoyagerEnv
+
+
+class VoyagerEnvPool:
+    """
+    N VoyagerEnv instances, each with its own mineflayer process on a distinct
+    server port, leased to rollouts one at a time.
+    A background thread health-checks idle environments and restarts dead
+    mineflayer processes so a lease always hands out a usable environment.
+    """
+
+    def __init__(
+        self,
+        size=None,
+        mc_port=None,
+        azure_login=None,
+        server_host="http://127.0.0.1",
+        base_server_port=3000,
+        request_timeout=600,
+        log_path="./logs",
+        health_check_interval=10,
+        **env_kwargs,
+    ):
+        self.size = size or os.cpu_count() or 1
+        if isinstance(mc_port, (list, tuple)):
+            assert len(mc_port) == self.size, "one mc_port per environment"
+            mc_ports = list(mc_port)
+        else:
+            mc_ports = [mc_port] * self.size
+        self.envs = []
+        for i in range(self.size):
+            # distinct usernames, so the "left the game" log line of one bot
+            # is never taken for another's
+            username = f"bot{i}"
+            self.envs.append(
+                VoyagerEnv(
+                    mc_port=mc_ports[i],
+                    azure_login=azure_login,
+                    server_host=server_host,
+                    server_port=base_server_port + i,
+                    request_timeout=request_timeout,
+                    log_path=U.f_join(log_path, f"env{i}"),
+                    username=username,
+                    **env_kwargs,
+                )
+            )
+        self.health_check_interval = health_check_interval
+        self._cond = threading.Condition()
+        self._idle = collections.deque(self.envs)
+        self._lease_start = {}
+        self._busy_time = {id(env): 0.0 for env in self.envs}
+        self._leases = {id(env): 0 for env in self.envs}
+        self._restarts = {id(env): 0 for env in self.envs}
+        self._start_time = time.monotonic()
+        self._stop_event = threading.Event()
+        self._health_thread = None
+
+    def start(self):
+        """
+        Spawn all mineflayer processes in parallel and start health checks.
+        The first reset of each environment starts its bot on the spawned
+        process.
+        """
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            list(executor.map(lambda env: env.mineflayer.run(), self.envs))
+        self._start_time = time.monotonic()
+        self._stop_event.clear()
+        self._health_thread = threading.Thread(
+            target=self._health_loop, name="voyager-env-pool-health", daemon=True
+        )
+        self._health_thread.start()
+        return self
+
+    def acquire(self, timeout=None):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._idle, timeout=timeout):
+                raise TimeoutError(
+                    f"No environment available in the pool after {timeout}s"
+                )
+            env = self._idle.popleft()
+            self._lease_start[id(env)] = time.monotonic()
+            self._leases[id(env)] += 1
+            return env
+
+    def release(self, env):
+        with self._cond:
+            start = self._lease_start.pop(id(env))
+            self._busy_time[id(env)] += time.monotonic() - start
+            self._idle.append(env)
+            self._cond.notify()
+
+    @contextlib.contextmanager
+    def lease(self, timeout=None):
+        env = self.acquire(timeout=timeout)
+        try:
+            yield env
+        finally:
+            self.release(env)
+
+    def utilization(self):
+        now = time.monotonic()
+        elapsed = max(now - self._start_time, 1e-9)
+        with self._cond:
+            per_env = []
+            for env in self.envs:
+                busy = self._busy_time[id(env)]
+                if id(env) in self._lease_start:
+                    busy += now - self._lease_start[id(env)]
+                per_env.append(
+                    {
+                        "server_port": env.server_port,
+                        "leased": id(env) in self._lease_start,
+                        "leases": self._leases[id(env)],
+                        "restarts": self._restarts[id(env)],
+                        "utilization": busy / elapsed,
+                    }
+                )
+            leased = len(self._lease_start)
+        return {
+            "size": self.size,
+            "leased": leased,
+            "idle": self.size - leased,
+            "utilization": sum(e["utilization"] for e in per_env) / self.size,
+            "envs": per_env,
+        }
+
+    def close(self):
+        self._stop_event.set()
+        if self._health_thread:
+            self._health_thread.join()
+        for env in self.envs:
+            try:
+                env.close()
+            except Exception as e:
+                print(f"\033[31mFailed to close env on port {env.server_port}: {e}\033[0m")
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _health_loop(self):
+        while not self._stop_event.wait(self.health_check_interval):
+            with self._cond:
+                # leased environments are supervised by their own step calls
+                candidates = list(self._idle)
+            for env in candidates:
+                # probed environments stay leasable, only dead ones are taken
+                # out of the pool while they restart
+                if env.is_healthy():
+                    continue
+                with self._cond:
+                    if env not in self._idle:
+                        # leased since, its step calls restart it
+                        continue
+                    self._idle.remove(env)
+                    self._restarts[id(env)] += 1
+                try:
+                    self._restart(env)
+                except Exception as e:
+                    print(
+                        f"\033[31mFailed to restart env on port {env.server_port}: {e}\033[0m"
+                    )
+                finally:
+                    with self._cond:
+                        self._idle.append(env)
+                        self._cond.notify()
+
+    def _restart(self, env):
+        print(f"\033[33mRestarting mineflayer on port {env.server_port}\033[0m")
+        env.mineflayer.stop()
+        if env.has_reset:
+            # reconnects the bot with the last reset options
+            env.check_process()
+        else:
+            env.mineflayer.run()
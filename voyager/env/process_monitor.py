@@ -1,3 +1,8 @@
+import collections
+import gzip
+import os
+import queue
+import shutil
 import time
 import re
 import warnings
@@ -6,12 +11,36 @@ from typing import List
 import psutil
 import subprocess
 import logging
+import logging.handlers
 import threading
 
 import voyager.utils as U
 
 
+class _RecordQueueHandler(logging.handlers.QueueHandler):
+    # records only cross threads of this process, leave the formatting to
+    # the listener thread instead of the subprocess reader
+    def prepare(self, record):
+        return record
+
+
+def _gzip_namer(name):
+    return name + ".gz"
+
+
+def _gzip_rotator(source, dest):
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
 class SubprocessMonitor:
+    IDLE = "idle"
+    STARTING = "starting"
+    READY = "ready"
+    EXITED = "exited"
+    FAILED = "failed"
+
     def __init__(
         self,
         commands: List[str],
@@ -21,23 +50,43 @@ class SubprocessMonitor:
         callback_match: str = r"^(?!x)x$",  # regex that will never match
         callback: callable = None,
         finished_callback: callable = None,
+        log_max_bytes: int = 50 * 1024**2,
+        log_backup_count: int = 5,
+        tail_lines: int = 200,
     ):
         self.commands = commands
         start_time = time.strftime("%Y%m%d_%H%M%S")
         self.name = name
-        self.logger = logging.getLogger(name)
-        handler = logging.FileHandler(U.f_join(log_path, f"{start_time}.log"))
+        # Output is written by a listener thread through a queue, to a log
+        # rotated at log_max_bytes with gzip-compressed backups. The logger
+        # is private to this monitor: monitors of a pool share their names.
+        self.logger = logging.Logger(name, logging.INFO)
+        handler = logging.handlers.RotatingFileHandler(
+            U.f_join(log_path, f"{start_time}.log"),
+            maxBytes=log_max_bytes,
+            backupCount=log_backup_count,
+            delay=True,
+        )
+        handler.namer = _gzip_namer
+        handler.rotator = _gzip_rotator
         formatter = logging.Formatter(
             "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
         )
         handler.setFormatter(formatter)
-        self.logger.addHandler(handler)
-        self.logger.setLevel(logging.INFO)
+        log_queue = queue.SimpleQueue()
+        self.logger.addHandler(_RecordQueueHandler(log_queue))
+        self.log_listener = logging.handlers.QueueListener(log_queue, handler)
+        self.log_listener.start()
+        # most recent output lines, to attach to errors
+        self.recent_lines = collections.deque(maxlen=tail_lines)
         self.process = None
+        self.state = self.IDLE
         self.ready_match = ready_match
         self.ready_event = None
         self.ready_line = None
         self.callback_match = callback_match
+        self._ready_re = re.compile(ready_match)
+        self._callback_re = re.compile(callback_match)
         self.callback = callback
         self.finished_callback = finished_callback
         self.thread = None
@@ -52,32 +101,70 @@ class SubprocessMonitor:
             universal_newlines=True,
         )
         print(f"Subprocess {self.name} started with PID {self.process.pid}.")
-        for line in iter(self.process.stdout.readline, ""):
-            self.logger.info(line.strip())
-            if re.search(self.ready_match, line):
+        return self.process
+
+    def _monitor(self, process, ready_event):
+        # process and ready_event are the ones of this run, a thread that
+        # outlives a restart must not touch the state of the next run
+        for line in iter(process.stdout.readline, ""):
+            line = line.rstrip()
+            self.recent_lines.append(line)
+            self.logger.info(line)
+            if not ready_event.is_set() and self._ready_re.search(line):
                 self.ready_line = line
+                self.state = self.READY
                 self.logger.info("Subprocess is ready.")
-                self.ready_event.set()
-            if re.search(self.callback_match, line):
+                ready_event.set()
+            if self._callback_re.search(line):
                 self.callback()
-        if not self.ready_event.is_set():
-            self.ready_event.set()
+        # stdout closed: reap the process so it does not linger as a zombie
+        # that psutil still reports as running
+        process.wait()
+        if process is not self.process:
+            return
+        if self.state == self.STARTING:
+            self.state = self.FAILED
             warnings.warn(f"Subprocess {self.name} failed to start.")
+        else:
+            self.state = self.EXITED
+        ready_event.set()
         if self.finished_callback:
             self.finished_callback()
 
-    def run(self):
+    def run(self, wait=True):
+        """Start the subprocess, wait=False returns before it is ready."""
         self.ready_event = threading.Event()
         self.ready_line = None
-        self.thread = threading.Thread(target=self._start)
+        self.state = self.STARTING
+        process = self._start()
+        self.thread = threading.Thread(
+            target=self._monitor, args=(process, self.ready_event)
+        )
         self.thread.start()
-        self.ready_event.wait()
+        if wait:
+            self.ready_event.wait()
+
+    def wait_ready(self, timeout=None):
+        if self.ready_event is None:
+            return False
+        self.ready_event.wait(timeout)
+        return self.is_ready
 
     def stop(self):
         self.logger.info("Stopping subprocess.")
         if self.process and self.process.is_running():
             self.process.terminate()
             self.process.wait()
+        if self.state in (self.STARTING, self.READY):
+            self.state = self.EXITED
+
+    def close(self):
+        self.stop()
+        self.log_listener.stop()
+
+    def tail(self, lines=50):
+        """The last output lines of the subprocess."""
+        return "\n".join(list(self.recent_lines)[-lines:])
 
     # def __del__(self):
     #     if self.process.is_running():
@@ -85,6 +172,249 @@ class SubprocessMonitor:
 
     @property
     def is_running(self):
-        if self.process is None:
+        if self.process is None or self.state in (self.EXITED, self.FAILED):
             return False
         return self.process.is_running()
+
+    @property
+    def is_ready(self):
+        return self.state == self.READY and self.is_running
+
+
+class ProcessSupervisor:
+    """
+    Supervise an active SubprocessMonitor and hot standbys of it that are
+    started on spare ports ahead of time. When the active process dies, run
+    swaps in a ready standby instead of a cold start and starts a new standby
+    in the background. Cold starts are retried with bounded exponential
+    backoff.
+    It exposes the SubprocessMonitor interface of the active process, the
+    port it serves on changes with every swap.
+    """
+
+    def __init__(
+        self,
+        factory: callable,
+        ports: List[int],
+        max_retries: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 10.0,
+    ):
+        self.monitors = {port: factory(port) for port in ports}
+        self.ports = list(ports)
+        self.port = self.ports[0]
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.swaps = 0
+        self.lock = threading.Lock()
+
+    @property
+    def active(self) -> SubprocessMonitor:
+        return self.monitors[self.port]
+
+    @property
+    def name(self):
+        return self.active.name
+
+    @property
+    def process(self):
+        return self.active.process
+
+    @property
+    def ready_line(self):
+        return self.active.ready_line
+
+    @property
+    def state(self):
+        return self.active.state
+
+    @property
+    def is_running(self):
+        return self.active.is_running
+
+    @property
+    def is_ready(self):
+        return self.active.is_ready
+
+    def run(self):
+        with self.lock:
+            if not self.active.is_running:
+                port = self._ready_standby()
+                if port is None:
+                    self._cold_start(self.active)
+                else:
+                    self.port = port
+                    self.swaps += 1
+                    print(f"Swapped in standby {self.name} on port {port}")
+            for port in self.ports:
+                monitor = self.monitors[port]
+                if port != self.port and monitor.state not in (
+                    monitor.STARTING,
+                    monitor.READY,
+                ):
+                    monitor.run(wait=False)
+
+    def stop(self):
+        """Stop the active process, standbys keep running."""
+        self.active.stop()
+
+    def close(self):
+        for monitor in self.monitors.values():
+            monitor.close()
+
+    def tail(self, lines=50):
+        return self.active.tail(lines)
+
+    def _ready_standby(self):
+        for port in self.ports:
+            monitor = self.monitors[port]
+            if port == self.port or monitor.state not in (
+                monitor.STARTING,
+                monitor.READY,
+            ):
+                continue
+            # a standby still starting is ready sooner than a cold start
+            if monitor.wait_ready():
+                return port
+        return None
+
+    def _cold_start(self, monitor):
+        for attempt in range(self.max_retries + 1):
+            monitor.run()
+            if monitor.is_ready:
+                return
+            if attempt < self.max_retries:
+                time.sleep(min(self.backoff * (2**attempt), self.max_backoff))
+        raise RuntimeError(
+            f"Subprocess {monitor.name} failed to start "
+            f"after {self.max_retries + 1} attempts"
+        )
+
+
+class ResourceSampler:
+    """
+    Sample CPU, memory, open file descriptors and child processes of
+    subprocesses (with their whole process tree, e.g. Puppeteer's Chrome) on a
+    background thread into bounded time series.
+    A sample over one of the ceilings flags the process for a restart, which
+    the owner performs at a safe point, between tasks, instead of the OS
+    killing it mid-step.
+    """
+
+    METRICS = ("cpu_percent", "rss", "num_fds", "num_children")
+
+    def __init__(self, monitors, interval=5.0, history=720, ceilings=None):
+        """
+        monitors maps a name to a SubprocessMonitor or ProcessSupervisor,
+        ceilings maps a name to limits of METRICS, e.g.
+        {"mineflayer": {"rss": 2 * 1024**3, "num_fds": 4096}}.
+        """
+        self.monitors = dict(monitors)
+        self.interval = interval
+        self.ceilings = dict(ceilings or {})
+        self.series = {
+            name: collections.deque(maxlen=history) for name in self.monitors
+        }
+        self.exceeded = {}
+        self._processes = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._loop, name="resource-sampler", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def sample(self):
+        for name, monitor in self.monitors.items():
+            if monitor is None or not monitor.is_running:
+                continue
+            sample = self._sample_tree(monitor.process)
+            if sample is None:
+                continue
+            with self._lock:
+                self.series[name].append(sample)
+                for metric, limit in self.ceilings.get(name, {}).items():
+                    if sample[metric] > limit and name not in self.exceeded:
+                        self.exceeded[name] = f"{metric} {sample[metric]} > {limit}"
+
+    def needs_restart(self):
+        """Names of the processes over a ceiling, with the reason."""
+        with self._lock:
+            return dict(self.exceeded)
+
+    def restarted(self, name):
+        with self._lock:
+            self.exceeded.pop(name, None)
+            self.series[name].clear()
+
+    def stats(self):
+        with self._lock:
+            stats = {}
+            for name, series in self.series.items():
+                if not series:
+                    continue
+                stats[name] = {
+                    "latest": dict(series[-1]),
+                    "peak": {
+                        metric: max(sample[metric] for sample in series)
+                        for metric in self.METRICS
+                    },
+                }
+            return stats
+
+    def _loop(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as e:
+                warnings.warn(f"Resource sampling failed: {e}")
+
+    def _sample_tree(self, process):
+        try:
+            children = process.children(recursive=True)
+        except psutil.Error:
+            return None
+        sample = {
+            "time": time.time(),
+            "pid": process.pid,
+            "cpu_percent": 0.0,
+            "rss": 0,
+            "num_fds": 0,
+            "num_children": len(children),
+        }
+        alive = {}
+        for proc in [process] + children:
+            # cpu_percent is measured since the previous call on the same
+            # Process object, keep them across samples
+            cached = self._processes.get(proc.pid)
+            if cached is None or cached != proc:
+                cached = proc
+            try:
+                with cached.oneshot():
+                    sample["cpu_percent"] += cached.cpu_percent(None)
+                    sample["rss"] += cached.memory_info().rss
+                    if hasattr(cached, "num_fds"):
+                        sample["num_fds"] += cached.num_fds()
+                    else:
+                        sample["num_fds"] += cached.num_handles()
+            except psutil.Error:
+                continue
+            alive[proc.pid] = cached
+        # drop exited processes, other trees are sampled with the same cache
+        self._processes = {
+            pid: proc for pid, proc in self._processes.items() if proc.is_running()
+        }
+        self._processes.update(alive)
+        return sample
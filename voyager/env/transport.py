@@ -0,0 +1,268 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+import voyager.utils as U
+
+from .observation import BASE_HEADER, SEQ_HEADER, WIRE_HEADER
+
+
+class RetryPolicy:
+    """
+    Retry policy of one endpoint. Only failures to open a connection are
+    retried, the request never left the client so resending is safe. Any
+    other error, e.g. a pooled connection dropped mid-request or a read
+    timeout on /step, may come after the server acted on the request and
+    is raised.
+    """
+
+    def __init__(self, max_retries=0, backoff=0.5, max_backoff=5.0):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def delay(self, attempt):
+        return min(self.backoff * (2**attempt), self.max_backoff)
+
+    @staticmethod
+    def never_sent(error):
+        """Whether the request failed before it could reach the server."""
+        if isinstance(error, requests.ConnectTimeout):
+            return True
+        reason = error.args[0] if error.args else None
+        # requests wraps the urllib3 MaxRetryError of the failed connection
+        reason = getattr(reason, "reason", reason)
+        return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+
+class EndpointStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.last_time = 0.0
+
+    @property
+    def mean_time(self):
+        return self.total_time / self.count if self.count else 0.0
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "retries": self.retries,
+            "total_time": self.total_time,
+            "mean_time": self.mean_time,
+            "max_time": self.max_time,
+            "last_time": self.last_time,
+        }
+
+
+class HttpTransport:
+    """
+    Keep-alive HTTP transport to the mineflayer server.
+    All requests go through one pooled ``requests.Session`` so a run of
+    thousands of steps reuses the same few TCP connections.
+    """
+
+    def __init__(
+        self,
+        base_url,
+        default_timeout=600,
+        timeouts=None,
+        retry_policies=None,
+        pool_maxsize=4,
+        recorder=None,
+    ):
+        self.base_url = base_url
+        self.default_timeout = default_timeout
+        self.timeouts = dict(timeouts or {})
+        self.retry_policies = {
+            "/start": RetryPolicy(max_retries=3),
+            "/pause": RetryPolicy(max_retries=3),
+            "/stop": RetryPolicy(max_retries=1),
+            "/abort": RetryPolicy(max_retries=1),
+        }
+        self.retry_policies.update(retry_policies or {})
+        self.recorder = recorder
+        self.stats = {}
+        self._lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_maxsize, max_retries=0
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def timeout_for(self, endpoint):
+        return self.timeouts.get(endpoint, self.default_timeout)
+
+    def retry_policy_for(self, endpoint):
+        return self.retry_policies.get(endpoint, RetryPolicy())
+
+    def post(self, endpoint, json=None, timeout=None, **kwargs):
+        return self.request("POST", endpoint, json=json, timeout=timeout, **kwargs)
+
+    def get(self, endpoint, timeout=None, **kwargs):
+        return self.request("GET", endpoint, timeout=timeout, **kwargs)
+
+    def request(self, method, endpoint, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.timeout_for(endpoint)
+        policy = self.retry_policy_for(endpoint)
+        stats = self._stats_for(endpoint)
+        attempt = 0
+        start = time.perf_counter()
+        while True:
+            try:
+                res = self.session.request(
+                    method, f"{self.base_url}{endpoint}", timeout=timeout, **kwargs
+                )
+                break
+            except requests.ConnectionError as e:
+                if attempt >= policy.max_retries or not policy.never_sent(e):
+                    self._record(stats, start, error=True, retries=attempt)
+                    raise
+                time.sleep(policy.delay(attempt))
+                attempt += 1
+            except requests.RequestException:
+                self._record(stats, start, error=True, retries=attempt)
+                raise
+        self._record(
+            stats, start, error=res.status_code != 200, retries=attempt
+        )
+        # streamed bodies are recorded by the caller once consumed
+        if self.recorder and not kwargs.get("stream"):
+            self.recorder.record(
+                endpoint,
+                kwargs.get("json"),
+                res.status_code,
+                res.text,
+                wire=res.headers.get(WIRE_HEADER),
+                seq=res.headers.get(SEQ_HEADER),
+                base=res.headers.get(BASE_HEADER),
+            )
+        return res
+
+    def probe(self, endpoint, timeout=5):
+        """
+        GET over a connection of its own instead of the pooled session, which
+        is not thread-safe, so another thread (e.g. a health check) can probe
+        the server while a step is running.
+        """
+        return requests.get(f"{self.base_url}{endpoint}", timeout=timeout)
+
+    def reset_connections(self):
+        """
+        Drop pooled connections, e.g. after the mineflayer process restarted
+        and every kept-alive socket points at a dead server.
+        """
+        for adapter in self.session.adapters.values():
+            adapter.close()
+
+    def latency_stats(self):
+        with self._lock:
+            return {
+                endpoint: stats.as_dict() for endpoint, stats in self.stats.items()
+            }
+
+    def close(self):
+        self.session.close()
+        if self.recorder:
+            self.recorder.close()
+
+    def _stats_for(self, endpoint):
+        with self._lock:
+            if endpoint not in self.stats:
+                self.stats[endpoint] = EndpointStats()
+            return self.stats[endpoint]
+
+    def _record(self, stats, start, error, retries):
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            stats.count += 1
+            stats.errors += int(error)
+            stats.retries += retries
+            stats.total_time += elapsed
+            stats.last_time = elapsed
+            stats.max_time = max(stats.max_time, elapsed)
+
+
+class TrafficRecorder:
+    """
+    Append every request/response pair between VoyagerEnv and the mineflayer
+    server to a JSON lines log, gzip-compressed when the path ends with .gz.
+    The concatenated programs string is written once per distinct content and
+    referenced by hash afterwards, so long runs stay small.
+    """
+
+    def __init__(self, path, flush_interval=5.0):
+        self.path = path
+        if os.path.dirname(path):
+            U.f_mkdir(os.path.dirname(path))
+        self.compressed = path.endswith(".gz")
+        if self.compressed:
+            self.file = gzip.open(path, "at", encoding="utf-8")
+        else:
+            self.file = open(path, "a", encoding="utf-8")
+        # every gzip flush ends a compression block, so compressed logs are
+        # only flushed every flush_interval seconds and on close
+        self.flush_interval = flush_interval
+        self.last_flush = time.monotonic()
+        self.seen_programs = set()
+        self.lock = threading.Lock()
+
+    def record(
+        self,
+        endpoint,
+        request,
+        status,
+        body,
+        wire=None,
+        stream=False,
+        seq=None,
+        base=None,
+    ):
+        request = dict(request or {})
+        with self.lock:
+            programs = request.get("programs")
+            if isinstance(programs, str) and programs:
+                program_hash = hashlib.sha256(programs.encode("utf-8")).hexdigest()
+                if program_hash not in self.seen_programs:
+                    self._write({"program": program_hash, "source": programs})
+                    self.seen_programs.add(program_hash)
+                request["programs"] = {"$program": program_hash}
+            record = {
+                "time": time.time(),
+                "endpoint": endpoint,
+                "request": request,
+                "status": status,
+                "wire": wire,
+                "stream": stream,
+                "body": body,
+            }
+            if seq is not None:
+                # delta observations only rebuild in recording order
+                record["seq"] = int(seq)
+                record["base"] = int(base)
+            self._write(record)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+    def _write(self, record):
+        self.file.write(json.dumps(record) + "\n")
+        now = time.monotonic()
+        if not self.compressed or now - self.last_flush >= self.flush_interval:
+            self.file.flush()
+            self.last_flush = now
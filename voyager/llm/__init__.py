@@ -0,0 +1,5 @@
+from .cache import LLMCache
+from .registry import LLMRegistry
+from .retry import CircuitBreaker, ResilientChatModel, RetryEngine
+from .tokens import TokenCounter
+from .tracing import LLMTracer, TracedChatModel
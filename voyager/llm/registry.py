@@ -0,0 +1,171 @@
+import threading
+
+import httpx
+from langchain_ollama import ChatOllama, OllamaEmbeddings
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+from .retry import ResilientChatModel, RetryEngine
+from .tracing import TracedChatModel
+
+
+class LLMRegistry:
+    """
+    The one place that builds the chat and embedding models of all agents.
+    Models are deduplicated by configuration, so agents asking for the same
+    model and temperature share an instance, and every model of the registry
+    goes through the same pooled HTTP transports. max_connections bounds the
+    requests in flight across all agents, further requests wait for a free
+    connection.
+    With a cache (LLMCache), chat models at temperature 0 answer identical
+    prompts from it. With a tracer (LLMTracer), chat() returns the model
+    wrapped to trace every call under the name of the asking agent.
+    Chat calls go through a RetryEngine (retries, circuit breakers) and
+    fall back to fallback_model when the primary model keeps failing.
+    """
+
+    PROVIDERS = ("openai", "ollama")
+    DEFAULT_EMBEDDING_MODELS = {
+        "openai": "text-embedding-ada-002",
+        "ollama": "mistral-small",
+    }
+
+    def __init__(
+        self,
+        provider="openai",
+        ollama_url="http://localhost:11434",
+        request_timeout=120,
+        max_connections=8,
+        cache=None,
+        tracer=None,
+        retry=None,
+        fallback_model=None,
+    ):
+        assert provider in self.PROVIDERS, f"provider {provider} not supported"
+        self.provider = provider
+        self.ollama_url = ollama_url
+        self.request_timeout = request_timeout
+        self.max_connections = max_connections
+        self.cache = cache
+        self.tracer = tracer
+        self.retry = retry if retry is not None else RetryEngine()
+        self.fallback_model = fallback_model
+        # the tracer counts the HTTP attempts of a call as its retries
+        self.event_hooks = {"request": [tracer.on_request]} if tracer else {}
+        limits = httpx.Limits(
+            max_connections=max_connections, max_keepalive_connections=max_connections
+        )
+        # the transports hold the connection pools, clients are thin wrappers
+        self.transport = httpx.HTTPTransport(limits=limits)
+        self.async_transport = httpx.AsyncHTTPTransport(limits=limits)
+        self.http_client = httpx.Client(
+            transport=self.transport,
+            timeout=request_timeout,
+            event_hooks=self.event_hooks,
+        )
+        self.http_async_client = httpx.AsyncClient(
+            transport=self.async_transport, timeout=request_timeout
+        )
+        self._models = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_options(
+        cls, ollama=False, ollama_url="http://localhost:11434", request_timeout=120
+    ):
+        """Registry of the ollama, ollama_url and request_timout agent options."""
+        return cls(
+            provider="ollama" if ollama else "openai",
+            ollama_url=ollama_url,
+            request_timeout=request_timeout,
+        )
+
+    @property
+    def ollama(self):
+        return self.provider == "ollama"
+
+    def chat(self, model_name, temperature=0, agent=None):
+        llm = self._get(
+            ("chat", model_name, temperature),
+            lambda: self._build_chat(model_name, temperature),
+        )
+        fallback = None
+        if self.fallback_model and self.fallback_model != model_name:
+            fallback = self._get(
+                ("chat", self.fallback_model, temperature),
+                lambda: self._build_chat(self.fallback_model, temperature),
+            )
+        llm = ResilientChatModel(
+            llm,
+            self.retry,
+            f"{self.provider}:{model_name}",
+            fallback=fallback,
+            fallback_key=f"{self.provider}:{self.fallback_model}",
+        )
+        if self.tracer is None:
+            return llm
+        return TracedChatModel(llm, self.tracer, agent or model_name)
+
+    def embeddings(self, model_name=None):
+        model_name = model_name or self.DEFAULT_EMBEDDING_MODELS[self.provider]
+        return self._get(
+            ("embeddings", model_name), lambda: self._build_embeddings(model_name)
+        )
+
+    def close(self):
+        # the async transport closes with its event loop
+        self.http_client.close()
+        if self.cache is not None:
+            self.cache.close()
+        if self.tracer is not None:
+            self.tracer.close()
+
+    def _get(self, key, build):
+        with self._lock:
+            if key not in self._models:
+                self._models[key] = build()
+            return self._models[key]
+
+    def _ollama_client_kwargs(self):
+        return {
+            "client_kwargs": {"timeout": self.request_timeout},
+            "sync_client_kwargs": {
+                "transport": self.transport,
+                "event_hooks": self.event_hooks,
+            },
+            "async_client_kwargs": {"transport": self.async_transport},
+        }
+
+    def _build_chat(self, model_name, temperature):
+        # only deterministic calls are worth answering from the cache
+        cache = self.cache if temperature == 0 else None
+        if self.ollama:
+            return ChatOllama(
+                base_url=self.ollama_url,
+                model=model_name,
+                temperature=temperature,
+                cache=cache,
+                **self._ollama_client_kwargs(),
+            )
+        return ChatOpenAI(
+            model=model_name,
+            temperature=temperature,
+            timeout=self.request_timeout,
+            # retries are left to the RetryEngine
+            max_retries=0,
+            http_client=self.http_client,
+            http_async_client=self.http_async_client,
+            cache=cache,
+        )
+
+    def _build_embeddings(self, model_name):
+        if self.ollama:
+            return OllamaEmbeddings(
+                model=model_name,
+                base_url=self.ollama_url,
+                **self._ollama_client_kwargs(),
+            )
+        return OpenAIEmbeddings(
+            model=model_name,
+            http_client=self.http_client,
+            http_async_client=self.http_async_client,
+        )
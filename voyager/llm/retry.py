@@ -0,0 +1,189 @@
+import random
+import threading
+import time
+
+import httpx
+import openai
+
+
+class CircuitBreaker:
+    """
+    Stop calling a model after failure_threshold failures in a row. Once open,
+    one trial call goes through every reset_timeout seconds and a success
+    closes the circuit again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # half open, the next trial waits for another timeout
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class RetryEngine:
+    """
+    Retry policy shared by the chat models of all agents. Transient errors
+    (connection failures, timeouts, rate limits, 5xx) are retried with full
+    jitter exponential backoff, other errors are raised at once. Each
+    provider/model has a circuit breaker, failures and calls slower than
+    slow_call seconds count against it, and calls go to the fallback model
+    while it is open or when the primary model ran out of retries.
+    Deterministic failures, such as unparsable responses, are retried by
+    the agents without sleeping.
+    """
+
+    TRANSIENT_STATUS = {408, 429}
+    TRANSIENT_ERRORS = (
+        ConnectionError,
+        TimeoutError,
+        httpx.TransportError,
+        openai.APIConnectionError,
+    )
+
+    def __init__(
+        self,
+        max_retries=3,
+        backoff=1.0,
+        max_backoff=30.0,
+        failure_threshold=5,
+        reset_timeout=60.0,
+        slow_call=None,
+    ):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.slow_call = slow_call
+        self.breakers = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, key):
+        with self._lock:
+            if key not in self.breakers:
+                self.breakers[key] = CircuitBreaker(
+                    self.failure_threshold, self.reset_timeout
+                )
+            return self.breakers[key]
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.backoff * (2**attempt), self.max_backoff))
+
+    def is_transient(self, error):
+        if isinstance(error, self.TRANSIENT_ERRORS):
+            return True
+        # openai.APIStatusError and ollama.ResponseError
+        status = getattr(error, "status_code", None)
+        return isinstance(status, int) and (
+            status in self.TRANSIENT_STATUS or status >= 500
+        )
+
+    def call(self, targets, fn):
+        """
+        Call fn(llm) on the first of the (key, llm) targets whose circuit is
+        closed, moving on to the next one when its retries run out.
+        """
+        error = None
+        for key, llm in targets:
+            breaker = self.breaker(key)
+            if not breaker.allow():
+                continue
+            for attempt in range(self.max_retries + 1):
+                start = time.perf_counter()
+                try:
+                    result = fn(llm)
+                except Exception as e:
+                    if not self.is_transient(e):
+                        raise
+                    breaker.record_failure()
+                    error = e
+                    if attempt == self.max_retries or breaker.is_open:
+                        break
+                    delay = self.delay(attempt)
+                    print(
+                        f"\033[31m{key} failed: {e}, retrying in {delay:.1f}s\033[0m"
+                    )
+                    time.sleep(delay)
+                    continue
+                if self.slow_call and time.perf_counter() - start > self.slow_call:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                return result
+        if error is None:
+            raise RuntimeError(
+                f"Circuit open for {', '.join(key for key, _ in targets)}"
+            )
+        raise error
+
+    def stats(self):
+        with self._lock:
+            return {
+                key: {"failures": breaker.failures, "open": breaker.is_open}
+                for key, breaker in self.breakers.items()
+            }
+
+
+class ResilientChatModel:
+    """A chat model calling through a RetryEngine, with an optional fallback model."""
+
+    def __init__(self, llm, engine, key, fallback=None, fallback_key=None):
+        self.llm = llm
+        self.engine = engine
+        self.targets = [(key, llm)]
+        if fallback is not None:
+            self.targets.append((fallback_key, fallback))
+
+    def invoke(self, messages, *args, **kwargs):
+        return self.engine.call(
+            self.targets, lambda llm: llm.invoke(messages, *args, **kwargs)
+        )
+
+    def stream(self, messages, *args, **kwargs):
+        # only failures before the first chunk can be retried
+        def first_chunk(llm):
+            chunks = llm.stream(messages, *args, **kwargs)
+            try:
+                return chunks, next(chunks)
+            except StopIteration:
+                return chunks, None
+            except BaseException:
+                chunks.close()
+                raise
+
+        chunks, chunk = self.engine.call(self.targets, first_chunk)
+        try:
+            if chunk is not None:
+                yield chunk
+                yield from chunks
+        finally:
+            chunks.close()
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
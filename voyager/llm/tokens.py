@@ -0,0 +1,37 @@
+import functools
+
+import tiktoken
+
+
+class TokenCounter:
+    """
+    Count the tokens of a text for one model with tiktoken. Models tiktoken
+    does not know (e.g. ollama ones) are counted with cl100k_base, which
+    only approximates their tokenizer, so exact is False. When the encoding
+    files cannot be loaded, e.g. offline, the count falls back to an
+    estimate of 4 characters per token.
+    """
+
+    CHARS_PER_TOKEN = 4
+
+    def __init__(self, model_name=None):
+        self.model_name = model_name
+        self.encoding, self.exact = load_encoding(model_name)
+
+    def count(self, text):
+        if self.encoding is None:
+            return -(-len(text) // self.CHARS_PER_TOKEN)
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+
+@functools.lru_cache(maxsize=None)
+def load_encoding(model_name=None):
+    """The encoding of the model and whether it is the model's own one."""
+    try:
+        return tiktoken.encoding_for_model(model_name), True
+    except Exception:
+        pass
+    try:
+        return tiktoken.get_encoding("cl100k_base"), False
+    except Exception:
+        return None, False
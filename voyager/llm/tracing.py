@@ -0,0 +1,211 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+import voyager.utils as U
+
+from .cache import LLMCache
+from .tokens import TokenCounter
+
+
+class LLMCall:
+    """Measurements of one LLM invocation, filled while it runs."""
+
+    def __init__(self, agent, model, messages):
+        self.agent = agent
+        self.model = model
+        self.messages = messages
+        self.start = time.perf_counter()
+        self.first_token_time = None
+        self.response = None
+
+    def first_token(self):
+        if self.first_token_time is None:
+            self.first_token_time = time.perf_counter() - self.start
+
+    def completed(self, response):
+        self.response = response
+
+
+class LLMTracer:
+    """
+    Record every LLM invocation of the agents to a JSON lines sink: agent,
+    model, prompt and completion tokens, wall time, time to first token (for
+    streamed calls), HTTP retries and whether the cache answered it. Token
+    counts are flagged estimated when neither tiktoken knows the model nor
+    the provider reported them, e.g. for ollama models.
+    end_iteration() appends a per-agent summary of the calls since the
+    previous one, e.g. once per Voyager.step.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.dirname(path):
+            U.f_mkdir(os.path.dirname(path))
+        self.file = open(path, "a", encoding="utf-8")
+        self.iteration = []
+        self._counters = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def on_request(self, request):
+        """httpx request hook, counts the HTTP attempts of the current call."""
+        self._local.requests = getattr(self._local, "requests", 0) + 1
+
+    @contextlib.contextmanager
+    def trace(self, agent, llm, messages):
+        call = LLMCall(agent, _model_name(llm), messages)
+        self._local.requests = 0
+        error = None
+        try:
+            yield call
+        except GeneratorExit:
+            # the consumer of a stream stopped reading, not a failure
+            raise
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            wall_time = time.perf_counter() - call.start
+            requests = self._local.requests
+            cache = getattr(llm, "cache", None)
+            cache_hit = isinstance(cache, LLMCache) and requests == 0 and cache.last_hit
+            # the model that answered, e.g. a fallback one
+            metadata = getattr(call.response, "response_metadata", None) or {}
+            call.model = metadata.get("model_name") or call.model
+            prompt_tokens, completion_tokens, estimated = self._count_tokens(call)
+            self._write(
+                {
+                    "time": time.time(),
+                    "agent": agent,
+                    "model": call.model,
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "tokens_estimated": estimated,
+                    "wall_time": wall_time,
+                    "ttft": call.first_token_time,
+                    "retries": max(requests - 1, 0),
+                    "cache_hit": cache_hit,
+                    "error": error,
+                }
+            )
+
+    def end_iteration(self, **info):
+        """Write and return the per-agent summary of the calls since the last one."""
+        with self._lock:
+            records, self.iteration = self.iteration, []
+        agents = {}
+        for record in records:
+            summary = agents.setdefault(
+                record["agent"],
+                {
+                    "calls": 0,
+                    "wall_time": 0.0,
+                    "max_wall_time": 0.0,
+                    "prompt_tokens": 0,
+                    "completion_tokens": 0,
+                    "tokens_estimated": False,
+                    "retries": 0,
+                    "cache_hits": 0,
+                    "errors": 0,
+                },
+            )
+            summary["calls"] += 1
+            summary["wall_time"] += record["wall_time"]
+            summary["max_wall_time"] = max(summary["max_wall_time"], record["wall_time"])
+            summary["prompt_tokens"] += record["prompt_tokens"] or 0
+            summary["completion_tokens"] += record["completion_tokens"] or 0
+            summary["tokens_estimated"] |= record["tokens_estimated"]
+            summary["retries"] += record["retries"]
+            summary["cache_hits"] += int(record["cache_hit"])
+            summary["errors"] += int(record["error"] is not None)
+        slowest = max(agents, key=lambda agent: agents[agent]["wall_time"], default=None)
+        summary = {"summary": {**info, "agents": agents, "slowest_agent": slowest}}
+        with self._lock:
+            self.file.write(json.dumps(summary) + "\n")
+            self.file.flush()
+        return summary["summary"]
+
+    def close(self):
+        with self._lock:
+            self.file.close()
+
+    def _write(self, record):
+        with self._lock:
+            self.iteration.append(record)
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()
+
+    def _count_tokens(self, call):
+        with self._lock:
+            if call.model not in self._counters:
+                self._counters[call.model] = TokenCounter(call.model)
+            counter = self._counters[call.model]
+        usage = getattr(call.response, "usage_metadata", None) or {}
+        if not counter.exact and "input_tokens" in usage:
+            # what the provider reported beats an estimate
+            return usage["input_tokens"], usage["output_tokens"], False
+        prompt_tokens = 0
+        for message in _as_messages(call.messages):
+            # every message is wrapped in a few formatting tokens
+            prompt_tokens += 4 + counter.count(_text_of(message))
+        completion_tokens = None
+        if call.response is not None:
+            completion_tokens = counter.count(_text_of(call.response))
+        return prompt_tokens, completion_tokens, not counter.exact
+
+
+class TracedChatModel:
+    """The chat model of one agent, reporting every invoke and stream to a tracer."""
+
+    def __init__(self, llm, tracer, agent):
+        self.llm = llm
+        self.tracer = tracer
+        self.agent = agent
+
+    def invoke(self, messages, *args, **kwargs):
+        with self.tracer.trace(self.agent, self.llm, messages) as call:
+            response = self.llm.invoke(messages, *args, **kwargs)
+            call.completed(response)
+        return response
+
+    def stream(self, messages, *args, **kwargs):
+        with self.tracer.trace(self.agent, self.llm, messages) as call:
+            response = None
+            chunks = self.llm.stream(messages, *args, **kwargs)
+            try:
+                for chunk in chunks:
+                    call.first_token()
+                    response = chunk if response is None else response + chunk
+                    yield chunk
+            finally:
+                # also when the consumer stops reading early, which closes
+                # the HTTP response of the stream
+                chunks.close()
+                call.completed(response)
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+
+def _model_name(llm):
+    return getattr(llm, "model_name", None) or getattr(llm, "model", None)
+
+
+def _as_messages(messages):
+    if isinstance(messages, str):
+        return [messages]
+    return messages
+
+
+def _text_of(message):
+    content = getattr(message, "content", message)
+    if isinstance(content, str):
+        return content
+    # multimodal content, images are not counted
+    return "".join(
+        part.get("text", "") if isinstance(part, dict) else str(part)
+        for part in content
+    )
@@ -2,10 +2,12 @@ import copy
 import json
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict
 
 import voyager.utils as U
-from .env import VoyagerEnv
+from .env import MockVoyagerEnv, ReplayVoyagerEnv, VoyagerEnv
+from .llm import LLMCache, LLMRegistry, LLMTracer, RetryEngine
 
 from .agents import ActionAgent
 from .agents import CriticAgent
@@ -23,6 +25,13 @@ class Voyager:
         openai_api_key: str = None,
         env_wait_ticks: int = 20,
         env_request_timeout: int = 600,
+        env_abort_on_error: bool = False,
+        env_mock: bool = False,
+        env_record_path: str = None,
+        env_replay_path: str = None,
+        env_delta_observations: bool = False,
+        env_hot_standby: bool = False,
+        env_resource_ceilings: Dict[str, Dict[str, float]] = None,
         max_iterations: int = 160,
         reset_placed_if_failed: bool = False,
         ollama:bool = False,
@@ -35,6 +44,8 @@ class Voyager:
         action_agent_task_max_retries: int = 4,
         action_agent_show_chat_log: bool = True,
         action_agent_show_execution_error: bool = True,
+        action_agent_prompt_token_budget: int = None,
+        action_agent_stream: bool = False,
         curriculum_agent_model_name: str = "gpt-4",
         curriculum_agent_temperature: float = 0,
         curriculum_agent_qa_model_name: str = "gpt-3.5-turbo",
@@ -43,13 +54,26 @@ class Voyager:
         curriculum_agent_core_inventory_items: str = r".*_log|.*_planks|stick|crafting_table|furnace"
         r"|cobblestone|dirt|coal|.*_pickaxe|.*_sword|.*_axe",
         curriculum_agent_mode: str = "auto",
+        curriculum_agent_speculative: bool = False,
+        curriculum_agent_qa_max_workers: int = 4,
+        curriculum_agent_qa_cache_threshold: float = 0.05,
         critic_agent_model_name: str = "gpt-4",
         critic_agent_temperature: float = 0,
         critic_agent_mode: str = "auto",
+        critic_agent_rules: bool = True,
         skill_manager_model_name: str = "gpt-3.5-turbo",
         skill_manager_temperature: float = 0,
         skill_manager_retrieval_top_k: int = 5,
         openai_api_request_timeout: int = 240,
+        llm_max_connections: int = 8,
+        llm_max_retries: int = 3,
+        llm_fallback_model_name: str = None,
+        llm_slow_call_timeout: float = None,
+        llm_cache: bool = None,
+        llm_cache_path: str = None,
+        llm_trace: bool = False,
+        llm_trace_path: str = None,
+        agent_max_workers: int = 4,
         ckpt_dir: str = "ckpt",
         skill_library_dir: str = None,
         resume: bool = False,
@@ -68,6 +92,17 @@ class Voyager:
         you should increase this value
         :param env_request_timeout: how many seconds to wait for each step, if the code execution exceeds this time,
         python side will terminate the connection and need to be resumed
+        :param env_abort_on_error: whether to stream step events and abort the program on the first execution error, control primitive giving up or when the bot makes no progress
+        instead of letting it run until it finishes or times out
+        :param env_mock: whether to run against the deterministic mock server instead of mineflayer and Minecraft,
+        useful to benchmark the python side
+        :param env_record_path: if set, record every request/response with the env server to this log (.jsonl or .jsonl.gz)
+        :param env_replay_path: if set, replay a log recorded with env_record_path instead of running the game
+        :param env_delta_observations: whether the env server only sends the changes of each observation
+        against the previous one, the full observations are rebuilt on the python side
+        :param env_hot_standby: whether to keep a second env server process ready to take over when the active one dies
+        :param env_resource_ceilings: if set, sample CPU, memory and open files of the mineflayer and minecraft processes
+        and restart a process over its ceilings between tasks, e.g. {"mineflayer": {"rss": 2 * 1024**3}}
         :param reset_placed_if_failed: whether to reset placed blocks if failed, useful for building task
         :param max_iterations: how many iterations to run
         :param ollama: whether to use ollama
@@ -78,6 +113,10 @@ class Voyager:
         :param action_agent_model_name: action agent model name
         :param action_agent_temperature: action agent temperature
         :param action_agent_task_max_retries: how many times to retry if failed
+        :param action_agent_prompt_token_budget: token budget of the action agent system message,
+        retrieved skills over it are replaced by their description or dropped, None for no limit
+        :param action_agent_stream: whether to stream the action agent response and stop reading
+        once its code block is complete
         :param curriculum_agent_model_name: curriculum agent model name
         :param curriculum_agent_temperature: curriculum agent temperature
         :param curriculum_agent_qa_model_name: curriculum agent qa model name
@@ -100,25 +139,71 @@ class Voyager:
         :param curriculum_agent_core_inventory_items: only show these items in inventory before optional_inventory_items
         reached in warm up
         :param curriculum_agent_mode: "auto" for automatic curriculum, "manual" for human curriculum
+        :param curriculum_agent_speculative: whether to propose the next task in the background
+        while the skill of the last one is described, "auto" mode only
+        :param curriculum_agent_qa_max_workers: how many curriculum QA questions are answered concurrently
+        :param curriculum_agent_qa_cache_threshold: embedding distance under which a cached QA question
+        answers a new one
         :param critic_agent_model_name: critic agent model name
         :param critic_agent_temperature: critic agent temperature
         :param critic_agent_mode: "auto" for automatic critic ,"manual" for human critic
+        :param critic_agent_rules: whether to decide Mine/Craft/Smelt/Kill N X tasks from the inventory
+        and kills without the LLM when possible
         :param skill_manager_model_name: skill manager model name
         :param skill_manager_temperature: skill manager temperature
         :param skill_manager_retrieval_top_k: how many skills to retrieve for each task
         :param openai_api_request_timeout: how many seconds to wait for openai api
+        :param llm_max_connections: how many LLM requests all agents together may have in flight
+        :param llm_max_retries: how many times a transient LLM error (connection, timeout, rate limit, 5xx)
+        is retried with jittered backoff
+        :param llm_fallback_model_name: model used when the one of an agent keeps failing
+        :param llm_slow_call_timeout: seconds after which an LLM call counts as a failure for the circuit
+        breaker of its model, None to ignore slow calls
+        :param llm_cache: whether to answer identical temperature 0 LLM calls from an on-disk cache,
+        by default only with env_mock or env_replay_path
+        :param llm_cache_path: path of the LLM cache, defaults to ckpt_dir/llm_cache.sqlite
+        :param llm_trace: whether to trace every LLM call (tokens, latency, retries, cache hits)
+        with a per-step summary
+        :param llm_trace_path: path of the LLM trace, defaults to ckpt_dir/llm_trace.jsonl
+        :param agent_max_workers: how many agent calls may run in the background,
+        e.g. skill retrieval while the critic runs
         :param ckpt_dir: checkpoint dir
         :param skill_library_dir: skill library dir
         :param resume: whether to resume from checkpoint
         """
         # init env
-        self.env = VoyagerEnv(
-            mc_port=mc_port,
-            azure_login=azure_login,
-            server_port=server_port,
-            request_timeout=env_request_timeout,
-        )
+        if env_replay_path:
+            self.env = ReplayVoyagerEnv(
+                replay_path=env_replay_path,
+                server_port=server_port,
+                request_timeout=env_request_timeout,
+                record_path=env_record_path,
+                delta_observations=env_delta_observations,
+                hot_standby=env_hot_standby,
+                resource_ceilings=env_resource_ceilings,
+            )
+        elif env_mock:
+            self.env = MockVoyagerEnv(
+                server_port=server_port,
+                request_timeout=env_request_timeout,
+                record_path=env_record_path,
+                delta_observations=env_delta_observations,
+                hot_standby=env_hot_standby,
+                resource_ceilings=env_resource_ceilings,
+            )
+        else:
+            self.env = VoyagerEnv(
+                mc_port=mc_port,
+                azure_login=azure_login,
+                server_port=server_port,
+                request_timeout=env_request_timeout,
+                record_path=env_record_path,
+                delta_observations=env_delta_observations,
+                hot_standby=env_hot_standby,
+                resource_ceilings=env_resource_ceilings,
+            )
         self.env_wait_ticks = env_wait_ticks
+        self.env_abort_on_error = env_abort_on_error
         self.reset_placed_if_failed = reset_placed_if_failed
         self.max_iterations = max_iterations
 
@@ -126,7 +211,29 @@ class Voyager:
         if not ollama:
             os.environ["OPENAI_API_KEY"] = openai_api_key
 
-        # init agents
+        # init agents, they share the models and connections of one registry
+        if llm_cache is None:
+            llm_cache = bool(env_mock or env_replay_path)
+        self.llm_registry = LLMRegistry(
+            provider="ollama" if ollama else "openai",
+            ollama_url=ollama_url,
+            request_timeout=openai_api_request_timeout,
+            max_connections=llm_max_connections,
+            cache=LLMCache(llm_cache_path or f"{ckpt_dir}/llm_cache.sqlite")
+            if llm_cache
+            else None,
+            tracer=LLMTracer(llm_trace_path or f"{ckpt_dir}/llm_trace.jsonl")
+            if llm_trace
+            else None,
+            retry=RetryEngine(
+                max_retries=llm_max_retries, slow_call=llm_slow_call_timeout
+            ),
+            fallback_model=llm_fallback_model_name,
+        )
+        # background agent calls of the main loop
+        self.executor = ThreadPoolExecutor(
+            max_workers=agent_max_workers, thread_name_prefix="voyager-agent"
+        )
         self.action_agent = ActionAgent(
             ollama=ollama,
             ollama_url=ollama_url,
@@ -140,6 +247,9 @@ class Voyager:
             resume=resume,
             chat_log=action_agent_show_chat_log,
             execution_error=action_agent_show_execution_error,
+            llm_registry=self.llm_registry,
+            prompt_token_budget=action_agent_prompt_token_budget,
+            stream=action_agent_stream,
         )
         self.action_agent_task_max_retries = action_agent_task_max_retries
         self.curriculum_agent = CurriculumAgent(
@@ -156,8 +266,11 @@ class Voyager:
             ckpt_dir=ckpt_dir,
             resume=resume,
             mode=curriculum_agent_mode,
+            qa_max_workers=curriculum_agent_qa_max_workers,
+            qa_cache_threshold=curriculum_agent_qa_cache_threshold,
             warm_up=curriculum_agent_warm_up,
             core_inventory_items=curriculum_agent_core_inventory_items,
+            llm_registry=self.llm_registry,
         )
         self.critic_agent = CriticAgent(
             ollama=ollama,
@@ -169,6 +282,8 @@ class Voyager:
             temperature=critic_agent_temperature,
             request_timout=openai_api_request_timeout,
             mode=critic_agent_mode,
+            llm_registry=self.llm_registry,
+            rules=critic_agent_rules,
         )
         self.skill_manager = SkillManager(
             ollama=ollama,
@@ -182,9 +297,13 @@ class Voyager:
             request_timout=openai_api_request_timeout,
             ckpt_dir=skill_library_dir if skill_library_dir else ckpt_dir,
             resume=True if resume or skill_library_dir else False,
+            llm_registry=self.llm_registry,
         )
         self.recorder = U.EventRecorder(ckpt_dir=ckpt_dir, resume=resume)
         self.resume = resume
+        self.curriculum_agent_speculative = (
+            curriculum_agent_speculative and curriculum_agent_mode == "auto"
+        )
 
         # init variables for rollout
         self.action_agent_rollout_num_iter = -1
@@ -193,6 +312,7 @@ class Voyager:
         self.messages = None
         self.conversations = []
         self.last_events = None
+        self.task_baseline = None
 
     def reset(self, task, context="", reset_env=True):
         self.action_agent_rollout_num_iter = 0
@@ -213,7 +333,9 @@ class Voyager:
             "bot.chat(`/time set ${getNextTime()}`);\n"
             + f"bot.chat('/difficulty {difficulty}');"
         )
-        skills = self.skill_manager.retrieve_skills(query=self.context)
+        # what the critic compares the task's outcome to
+        self.task_baseline = copy.deepcopy(events[-1][1])
+        skills = self.skill_manager.retrieve_skill_entries(query=self.context)
         print(
             f"\033[33mRender Action Agent system message with {len(skills)} skills\033[0m"
         )
@@ -231,11 +353,21 @@ class Voyager:
 
     def close(self):
         self.env.close()
+        # running agent calls, e.g. a speculated task, still use the LLM clients
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        print(f"\033[35mQA cache: {self.curriculum_agent.qa_cache_stats()}\033[0m")
+        print(
+            f"\033[31mCritic decisions: {self.critic_agent.rule_decisions} by rules, "
+            f"{self.critic_agent.llm_decisions} by LLM\033[0m"
+        )
+        if self.llm_registry.cache is not None:
+            print(f"\033[36mLLM cache: {self.llm_registry.cache.stats()}\033[0m")
+        self.llm_registry.close()
 
     def step(self):
         if self.action_agent_rollout_num_iter < 0:
             raise ValueError("Agent must be reset before stepping")
-        ai_message = self.action_agent.llm.invoke(self.messages)
+        ai_message = self.action_agent.generate(self.messages)
         print(f"\033[34m****Action Agent ai message****\n{ai_message.content}\033[0m")
         self.conversations.append(
             (self.messages[0].content, self.messages[1].content, ai_message.content)
@@ -246,16 +378,26 @@ class Voyager:
             code = parsed_result["program_code"] + "\n" + parsed_result["exec_code"]
             events = self.env.step(
                 code,
-                programs=self.skill_manager.programs,
+                programs=self.skill_manager.program_list,
+                abort_on=(
+                    (lambda event: event.type in ("onError", "onStuck"))
+                    if self.env_abort_on_error
+                    else None
+                ),
             )
             self.recorder.record(events, self.task)
             self.action_agent.update_chest_memory(events[-1][1]["nearbyChests"])
+            # the next system message does not depend on the critic
+            system_message_future = self.executor.submit(
+                self.render_next_system_message, events
+            )
             success, critique = self.critic_agent.check_task_success(
                 events=events,
                 task=self.task,
                 context=self.context,
                 chest_observation=self.action_agent.render_chest_observation(),
                 max_retries=5,
+                baseline=self.task_baseline,
             )
 
             if self.reset_placed_if_failed and not success:
@@ -270,16 +412,11 @@ class Voyager:
                         positions.append(position)
                 new_events = self.env.step(
                     f"await givePlacedItemBack(bot, {U.json_dumps(blocks)}, {U.json_dumps(positions)})",
-                    programs=self.skill_manager.programs,
+                    programs=self.skill_manager.program_list,
                 )
                 events[-1][1]["inventory"] = new_events[-1][1]["inventory"]
                 events[-1][1]["voxels"] = new_events[-1][1]["voxels"]
-            new_skills = self.skill_manager.retrieve_skills(
-                query=self.context
-                + "\n\n"
-                + self.action_agent.summarize_chatlog(events)
-            )
-            system_message = self.action_agent.render_system_message(skills=new_skills)
+            system_message = system_message_future.result()
             human_message = self.action_agent.render_human_message(
                 events=events,
                 code=parsed_result["program_code"],
@@ -314,8 +451,25 @@ class Voyager:
             print(
                 f"\033[32m****Action Agent human message****\n{self.messages[-1].content[-1]['text']}\033[0m"
             )
+        if self.llm_registry.tracer is not None:
+            summary = self.llm_registry.tracer.end_iteration(
+                task=self.task, iteration=self.action_agent_rollout_num_iter
+            )
+            if summary["slowest_agent"] is not None:
+                slowest = summary["agents"][summary["slowest_agent"]]
+                print(
+                    f"\033[36mLLM calls: {sum(a['calls'] for a in summary['agents'].values())}, "
+                    f"slowest agent {summary['slowest_agent']} "
+                    f"({slowest['calls']} calls, {slowest['wall_time']:.2f}s)\033[0m"
+                )
         return self.messages, 0, done, info
 
+    def render_next_system_message(self, events):
+        new_skills = self.skill_manager.retrieve_skill_entries(
+            query=self.context + "\n\n" + self.action_agent.summarize_chatlog(events)
+        )
+        return self.action_agent.render_system_message(skills=new_skills)
+
     def rollout(self, *, task, context, reset_env=True):
         self.reset(task=task, context=context, reset_env=reset_env)
         while True:
@@ -344,15 +498,22 @@ class Voyager:
             self.resume = True
         self.last_events = self.env.step("")
 
+        speculation = None
         while True:
             if self.recorder.iteration > self.max_iterations:
                 print("Iteration limit reached")
+                if speculation is not None:
+                    speculation.cancel()
                 break
-            task, context = self.curriculum_agent.propose_next_task(
-                events=self.last_events,
-                chest_observation=self.action_agent.render_chest_observation(),
-                max_retries=5,
-            )
+            if speculation is not None:
+                task, context = speculation.result()
+                speculation = None
+            else:
+                task, context = self.curriculum_agent.propose_next_task(
+                    events=self.last_events,
+                    chest_observation=self.action_agent.render_chest_observation(),
+                    max_retries=5,
+                )
             print(
                 f"\033[35mStarting task {task} for at most {self.action_agent_task_max_retries} times\033[0m"
             )
@@ -382,10 +543,21 @@ class Voyager:
                 print("Your last round rollout terminated due to error:")
                 print(f"\033[41m{e}\033[0m")
 
+            # the next task only depends on the progress and the last observation,
+            # it can be proposed while the new skill is described. The progress
+            # is recorded first since the proposal reads the completed and
+            # failed tasks, add_new_skill does not depend on it.
+            self.curriculum_agent.update_exploration_progress(info)
+            if self.curriculum_agent_speculative:
+                speculation = self.executor.submit(
+                    self.curriculum_agent.propose_next_task,
+                    events=self.last_events,
+                    chest_observation=self.action_agent.render_chest_observation(),
+                    max_retries=5,
+                )
             if info["success"]:
                 self.skill_manager.add_new_skill(info)
 
-            self.curriculum_agent.update_exploration_progress(info)
             print(
                 f"\033[35mCompleted tasks: {', '.join(self.curriculum_agent.completed_tasks)}\033[0m"
             )